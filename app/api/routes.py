@@ -1,36 +1,44 @@
 #routes.py
+import json
+import os
 from fastapi import APIRouter, HTTPException
-from app.models.schemas import FeedbackRequest, NLPQueryRequest, NLPQueryResponse
-from app.core.nlp_processor import process_nlp_query
+from fastapi.responses import StreamingResponse
+from app.models.schemas import FeedbackRequest, NLPQueryRequest, NLPQueryResponse, NLPBatchRequest, NLPBatchResponse
+from app.core.nlp_processor import process_nlp_query, process_nlp_queries, stream_nlp_query
+from app.core.schema_cache import schema_cache
+from app.core.query_matcher import query_matcher
+from app.core.schema_retriever import schema_retriever
+from app.core.cubejs_client import cubejs_client
+from app.core.response_cache import response_cache
 from app.utils.logger import logger
-from app.vector_store.store_manager import add_query_to_vector_store, search_similar_queries
+from app.vector_store.store_manager import aupdate_query_metadata, write_queue
 
 router = APIRouter()
 
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))  # Largest batch accepted by /ask/batch
+
 @router.post("/feedback")
 async def submit_feedback(feedback: FeedbackRequest):
     """
     Handle feedback submission for a particular query.
     """
     try:
-        # Retrieve the query result by request ID
-        results = search_similar_queries(feedback.request_id, k=1)
-        if not results:
+        # Update the feedback in place on the records stored for this request ID
+        updated = await aupdate_query_metadata(
+            feedback.request_id,
+            {"feedback": {"rating": feedback.rating, "message": feedback.message}}
+        )
+        if not updated:
             logger.warning(f"Feedback submission failed: Request ID {feedback.request_id} not found.")
             raise HTTPException(status_code=404, detail="Request ID not found")
 
-        result = results[0]
-        updated_metadata = result.get('metadata', {})
-        logger.info(f"Current metadata for Request ID {feedback.request_id}: {updated_metadata}")
-
-        # Update the feedback in the metadata
-        updated_metadata['feedback'] = {"rating": feedback.rating, "message": feedback.message}
-
-        # Update the vector store with the new metadata
-        add_query_to_vector_store(feedback.request_id, result['response'], updated_metadata)
+        # Well-rated answers become reusable from the cache; poorly rated ones are dropped
+        response_cache.rate_request(feedback.request_id, feedback.rating)
 
         logger.info(f"Feedback updated successfully for Request ID {feedback.request_id}")
         return {"status": "success", "message": "Feedback submitted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error submitting feedback: {str(e)}")
         raise HTTPException(status_code=500, detail="Error submitting feedback")
@@ -45,7 +53,7 @@ async def nlp_to_sql(request: NLPQueryRequest):
         logger.info(f"Processing NLP query: {request.query}")
 
         # Process the query and generate the corresponding SQL or Cube.js query
-        formatted_data, request_id = process_nlp_query(request.query)
+        formatted_data, request_id = await process_nlp_query(request.query)
 
         logger.info(f"NLP query processed successfully: {request.query}")
         return NLPQueryResponse(query=request.query, formatted_data=formatted_data, request_id=request_id)
@@ -58,6 +66,87 @@ async def nlp_to_sql(request: NLPQueryRequest):
         logger.error(f"Error processing NLP query: {str(e)}")
         raise HTTPException(status_code=500, detail="An error occurred while processing your request")
 
+
+@router.post("/ask/batch", response_model=NLPBatchResponse)
+async def nlp_to_sql_batch(request: NLPBatchRequest):
+    """
+    Handle many natural language queries in one call. Each question gets its own result and status;
+    a failing question does not fail the batch.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries provided")
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries per batch")
+    try:
+        logger.info(f"Processing batch of {len(request.queries)} NLP queries")
+        results = await process_nlp_queries(request.queries)
+        return NLPBatchResponse(results=results)
+    except Exception as e:
+        logger.error(f"Error processing NLP query batch: {str(e)}")
+        raise HTTPException(status_code=500, detail="An error occurred while processing your request")
+
+
+def _sse_event(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+@router.post("/ask/stream")
+async def nlp_to_sql_stream(request: NLPQueryRequest):
+    """
+    Server-Sent Events variant of /ask. Emits "query", "progress", "rows" and "token" events as each pipeline
+    stage completes, then "done" with the complete answer, or "error" if the pipeline fails.
+    """
+    async def events():
+        try:
+            logger.info(f"Streaming NLP query: {request.query}")
+            async for event, payload in stream_nlp_query(request.query):
+                yield _sse_event(event, payload)
+            logger.info(f"NLP query streamed successfully: {request.query}")
+        except ValueError as ve:
+            logger.warning(f"ValueError encountered while streaming NLP query: {str(ve)}")
+            yield _sse_event("error", {"status_code": 400, "detail": f"Query error: {str(ve)}"})
+        except Exception as e:
+            logger.error(f"Error streaming NLP query: {str(e)}")
+            yield _sse_event("error", {"status_code": 500, "detail": "An error occurred while processing your request"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/schema/stats")
+async def schema_cache_stats():
+    """
+    Report hit/miss/refresh counters for the cached Cube.js schema, its member retrieval and the fast path.
+    """
+    return {**schema_cache.stats(), "retrieval": schema_retriever.stats(), "fast_path": query_matcher.stats()}
+
+
+@router.get("/cache/stats")
+async def response_cache_stats():
+    """
+    Report exact and semantic hit counters for the response cache.
+    """
+    return response_cache.stats()
+
+
+@router.get("/vector_store/stats")
+async def vector_store_stats():
+    """
+    Report queued, flushed and failed writes of the vector store write-behind queue.
+    """
+    return write_queue.stats()
+
+
+@router.get("/cubejs/stats")
+async def cubejs_client_stats():
+    """
+    Report request, retry and latency metrics per Cube.js endpoint.
+    """
+    return cubejs_client.stats()
+
 #
 #
 # # Fetch all queries
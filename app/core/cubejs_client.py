@@ -1,90 +1,252 @@
 #cubejs_client.py
-import requests
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+import httpx
 import os
 from app.utils.logger import logger
 
 CUBEJS_API_URL = os.getenv("CUBEJS_API_URL")
 CUBEJS_API_TOKEN = os.getenv("CUBEJS_API_TOKEN")
 
+# Per-endpoint request timeouts in seconds
+CUBEJS_TIMEOUTS = {
+    "meta": float(os.getenv("CUBEJS_META_TIMEOUT", "10")),
+    "sql": float(os.getenv("CUBEJS_SQL_TIMEOUT", "10")),
+    "load": float(os.getenv("CUBEJS_LOAD_TIMEOUT", "60")),
+}
+CUBEJS_CONNECT_TIMEOUT = float(os.getenv("CUBEJS_CONNECT_TIMEOUT", "5"))
+CUBEJS_MAX_RETRIES = int(os.getenv("CUBEJS_MAX_RETRIES", "2"))  # Retries after the first attempt on 5xx/transport errors
+CUBEJS_RETRY_BACKOFF = float(os.getenv("CUBEJS_RETRY_BACKOFF", "0.25"))  # Base delay in seconds, doubled per retry
+CUBEJS_MAX_CONNECTIONS = int(os.getenv("CUBEJS_MAX_CONNECTIONS", "20"))
+
+# /load results are fetched in pages and capped so a query without a limit cannot exhaust memory
+CUBEJS_PAGE_SIZE = int(os.getenv("CUBEJS_PAGE_SIZE", "5000"))  # Rows requested per /load call
+CUBEJS_MAX_ROWS = int(os.getenv("CUBEJS_MAX_ROWS", "50000"))  # Rows kept per query
+CUBEJS_MAX_BYTES = int(os.getenv("CUBEJS_MAX_BYTES", str(32 * 2**20)))  # Response bytes read per query
+
+# Cube.js answers queries still running (e.g. building pre-aggregations) with {"error": "Continue wait"}
+CONTINUE_WAIT = "Continue wait"
+CUBEJS_WAIT_TIMEOUT = float(os.getenv("CUBEJS_WAIT_TIMEOUT", "120"))  # Overall seconds to wait for one query
+CUBEJS_WAIT_INITIAL = float(os.getenv("CUBEJS_WAIT_INITIAL", "0.5"))  # First delay between polls, doubled per poll
+CUBEJS_WAIT_MAX = float(os.getenv("CUBEJS_WAIT_MAX", "5"))  # Longest delay between polls
+
+
+class EndpointMetrics:
+    """Request counters and a rolling window of latencies for one Cube.js endpoint."""
+
+    def __init__(self, window: int = 1000):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.waits = 0
+        self._latencies = deque(maxlen=window)
+
+    def record(self, latency_ms: float, ok: bool):
+        self.requests += 1
+        self._latencies.append(latency_ms)
+        if not ok:
+            self.errors += 1
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self._latencies)
+        pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 2) if latencies else None
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "waits": self.waits,
+            "p50_ms": pick(0.50),
+            "p95_ms": pick(0.95),
+            "max_ms": round(latencies[-1], 2) if latencies else None,
+        }
+
+
+class CubeJSClient:
+    """
+    Shared Cube.js API client. Keeps pooled keep-alive connections (one sync client for the
+    schema refresher, one async client for request handlers), applies per-endpoint timeouts,
+    retries 5xx and transport errors with jittered exponential backoff, and records latency
+    per endpoint.
+    """
+
+    def __init__(self, base_url: str = CUBEJS_API_URL, token: str = CUBEJS_API_TOKEN):
+        self.base_url = base_url or ""
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": token or ""
+        }
+        self.limits = httpx.Limits(max_connections=CUBEJS_MAX_CONNECTIONS, max_keepalive_connections=CUBEJS_MAX_CONNECTIONS)
+        self.metrics = {endpoint: EndpointMetrics() for endpoint in CUBEJS_TIMEOUTS}
+        self._sync_client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    def _timeout(self, endpoint: str) -> httpx.Timeout:
+        return httpx.Timeout(CUBEJS_TIMEOUTS[endpoint], connect=CUBEJS_CONNECT_TIMEOUT)
+
+    def _sync(self) -> httpx.Client:
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(base_url=self.base_url, headers=self.headers, limits=self.limits)
+            return self._sync_client
+
+    def _async(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(base_url=self.base_url, headers=self.headers, limits=self.limits)
+        return self._async_client
+
+    @staticmethod
+    def _retryable(response) -> bool:
+        return response is None or response.status_code >= 500
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        # Full jitter: uniform delay up to the exponential cap
+        return random.uniform(0, CUBEJS_RETRY_BACKOFF * (2 ** attempt))
+
+    def request(self, method: str, endpoint: str, **kwargs) -> httpx.Response:
+        metrics = self.metrics[endpoint]
+        for attempt in range(CUBEJS_MAX_RETRIES + 1):
+            start = time.perf_counter()
+            response, error = None, None
+            try:
+                response = self._sync().request(method, f"/{endpoint}", timeout=self._timeout(endpoint), **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            metrics.record((time.perf_counter() - start) * 1000, ok=not self._retryable(response))
+            if not self._retryable(response) or attempt == CUBEJS_MAX_RETRIES:
+                break
+            metrics.retries += 1
+            time.sleep(self._backoff(attempt))
+        if error is not None:
+            raise error
+        return response
+
+    async def arequest(self, method: str, endpoint: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        Async request with retries. With `stream=True` the body is not read; the caller reads it
+        with `aiter_bytes()` and must `aclose()` the response.
+        """
+        metrics = self.metrics[endpoint]
+        for attempt in range(CUBEJS_MAX_RETRIES + 1):
+            start = time.perf_counter()
+            response, error = None, None
+            try:
+                client = self._async()
+                request = client.build_request(method, f"/{endpoint}", timeout=self._timeout(endpoint), **kwargs)
+                response = await client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                error = e
+            metrics.record((time.perf_counter() - start) * 1000, ok=not self._retryable(response))
+            if not self._retryable(response) or attempt == CUBEJS_MAX_RETRIES:
+                break
+            if stream and response is not None:
+                await response.aclose()
+            metrics.retries += 1
+            await asyncio.sleep(self._backoff(attempt))
+        if error is not None:
+            raise error
+        return response
+
+    def stats(self) -> dict:
+        return {endpoint: metrics.snapshot() for endpoint, metrics in self.metrics.items()}
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        with self._lock:
+            if self._sync_client is not None:
+                self._sync_client.close()
+                self._sync_client = None
+
+
+cubejs_client = CubeJSClient()
+
+
+def fetch_cube_meta():
+    """Fetch the raw schema document from the Cube.js /meta endpoint."""
+    response = cubejs_client.request("GET", "meta")
+    response.raise_for_status()
+    return response.json()
+
 
 def load_cube_models_and_views():
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": CUBEJS_API_TOKEN
-    }
     try:
-        response = requests.get(f"{CUBEJS_API_URL}/meta", headers=headers)
-        response.raise_for_status()
-
-        cubejs_meta = response.json()
-        models = {}
-        views = {}
-
-        for cube in cubejs_meta['cubes']:
-            cube_name = cube['name']
-            details = {
-                "measures": [],
-                "dimensions": [],
-                "timeDimensions": []
-            }
+        cubejs_meta = fetch_cube_meta()
+        return parse_cube_meta(cubejs_meta)
 
-            # Process measures
-            for measure in cube['measures']:
-                measure_info = {
-                    "name": measure['name'],
-                    "title": measure.get('title'),
-                    "description": measure.get('description'),
-                    "shortTitle": measure.get('shortTitle'),
-                    "type": measure.get('type'),
-                    "aggType": measure.get('aggType')
-                }
-                details["measures"].append(measure_info)
-
-            # Process dimensions
-            for dimension in cube['dimensions']:
-                dimension_info = {
-                    "name": dimension['name'],
-                    "title": dimension.get('title'),
-                    "description": dimension.get('description'),
-                    "shortTitle": dimension.get('shortTitle'),
-                    "type": dimension.get('type')
-                }
-
-                # Check if the dimension has metadata (possible values, synonyms, etc.)
-                if 'meta' in dimension:
-                    dimension_info['meta'] = dimension['meta']
-
-                    # Extract possible values and synonyms if available in meta
-                    if 'possibleValues' in dimension['meta']:
-                        dimension_info['possibleValues'] = dimension['meta']['possibleValues']
-
-                    if 'synonyms' in dimension['meta']:
-                        dimension_info['synonyms'] = dimension['meta']['synonyms']
-
-                details["dimensions"].append(dimension_info)
-
-            # Add time dimensions separately if type is 'time'
-            details["timeDimensions"] = [dimension['name'] for dimension in cube['dimensions'] if dimension['type'] == 'time']
-
-            # Separate views and models
-            if cube_name.endswith("_view"):
-                views[cube_name] = details
-            else:
-                models[cube_name] = details
-
-        logger.info("Cube.js models and views loaded successfully with titles, descriptions, and sample values.")
-        return models, views
-
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Failed to load Cube.js models and views: {str(e)}")
         return None, None
 
+
+def parse_cube_meta(cubejs_meta: dict):
+    """Split a Cube.js /meta document into (models, views) keyed by cube name."""
+    models = {}
+    views = {}
+
+    for cube in cubejs_meta['cubes']:
+        cube_name = cube['name']
+        details = {
+            "measures": [],
+            "dimensions": [],
+            "timeDimensions": []
+        }
+
+        # Process measures
+        for measure in cube['measures']:
+            measure_info = {
+                "name": measure['name'],
+                "title": measure.get('title'),
+                "description": measure.get('description'),
+                "shortTitle": measure.get('shortTitle'),
+                "type": measure.get('type'),
+                "aggType": measure.get('aggType')
+            }
+            details["measures"].append(measure_info)
+
+        # Process dimensions
+        for dimension in cube['dimensions']:
+            dimension_info = {
+                "name": dimension['name'],
+                "title": dimension.get('title'),
+                "description": dimension.get('description'),
+                "shortTitle": dimension.get('shortTitle'),
+                "type": dimension.get('type')
+            }
+
+            # Check if the dimension has metadata (possible values, synonyms, etc.)
+            if 'meta' in dimension:
+                dimension_info['meta'] = dimension['meta']
+
+                # Extract possible values and synonyms if available in meta
+                if 'possibleValues' in dimension['meta']:
+                    dimension_info['possibleValues'] = dimension['meta']['possibleValues']
+
+                if 'synonyms' in dimension['meta']:
+                    dimension_info['synonyms'] = dimension['meta']['synonyms']
+
+            details["dimensions"].append(dimension_info)
+
+        # Add time dimensions separately if type is 'time'
+        details["timeDimensions"] = [dimension['name'] for dimension in cube['dimensions'] if dimension['type'] == 'time']
+
+        # Separate views and models
+        if cube_name.endswith("_view"):
+            views[cube_name] = details
+        else:
+            models[cube_name] = details
+
+    logger.info("Cube.js models and views loaded successfully with titles, descriptions, and sample values.")
+    return models, views
+
 def get_sql_from_cubejs(query):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": CUBEJS_API_TOKEN
-    }
-    response = requests.post(f"{CUBEJS_API_URL}/sql", json={"query": query}, headers=headers)
+    response = cubejs_client.request("POST", "sql", json={"query": query})
     if response.status_code == 200:
         sql_response = response.json()
         sql_query = sql_response.get('sql', {}).get('sql', [])[0]
@@ -96,32 +258,162 @@ def get_sql_from_cubejs(query):
         return None
 
 
-def get_data_from_cubejs(query):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": CUBEJS_API_TOKEN
-    }
+def _load_error_message(status_code: int) -> str:
+    # Handle specific Cube.js API errors
+    if status_code == 400:
+        return "Bad request. The query format might be incorrect."
+    elif status_code == 422:
+        return "Invalid dimensions or measures."
+    # Generic error message for other non-200 responses
+    return f"Cube.js API returned status code {status_code}."
 
-    try:
-        response = requests.post(f"{CUBEJS_API_URL}/load", json={"query": query}, headers=headers)
 
-        # Return status code and response message
-        if response.status_code == 200:
-            data = response.json()
-            return response.status_code, data if data else "No data returned from Cube.js."
+class CubeJSLoad:
+    """
+    Paged /load of one Cube.js query. `pages()` requests `page_size` rows at a time with limit/offset,
+    reads each response body as a stream and yields its rows, so at most one page is held at once.
+    Loading stops at the query's own limit, after `max_rows` rows or once `max_bytes` of response
+    bodies were read; `truncated` tells whether rows were left out.
 
-        # Handle specific Cube.js API errors
-        elif response.status_code == 400:
-            return response.status_code, "Bad request. The query format might be incorrect."
-        elif response.status_code == 422:
-            return response.status_code, "Invalid dimensions or measures."
+    A page answered with "Continue wait" is polled again with exponential backoff until `wait_timeout`
+    seconds have passed since loading started. `events()` yields ("progress", info) pairs while
+    waiting, next to ("rows", rows).
 
-        # Generic error message for other non-200 responses
-        return response.status_code, f"Cube.js API returned status code {response.status_code}."
+    After iterating, `status_code` and `error` describe a failure, and `response` holds the first
+    page's body without its rows (annotation, refresh keys).
+    """
 
-    except requests.exceptions.RequestException as e:
-        # Handle network-related errors or request failures
-        return None, f"An error occurred while connecting to Cube.js API. Error: {str(e)}"
+    def __init__(self, query: dict, page_size: int = CUBEJS_PAGE_SIZE, max_rows: int = CUBEJS_MAX_ROWS,
+                 max_bytes: int = CUBEJS_MAX_BYTES, wait_timeout: float = CUBEJS_WAIT_TIMEOUT):
+        self.query = query
+        self.page_size = max(1, page_size)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.wait_timeout = wait_timeout
+        self.waits = 0
+        self.status_code = None
+        self.error = None
+        self.response = {}
+        self.rows_loaded = 0
+        self.bytes_loaded = 0
+        self.pages_loaded = 0
+        self.truncated = False
+
+    async def pages(self):
+        async for event, payload in self.events():
+            if event == "rows":
+                yield payload
+
+    async def events(self):
+        deadline = time.monotonic() + self.wait_timeout
+        query_limit = self.query.get("limit")
+        cap = self.max_rows if query_limit is None else min(int(query_limit), self.max_rows)
+        # Ask for one row past the cap so reaching it is not mistaken for truncation
+        probe = query_limit is None or int(query_limit) > self.max_rows
+        base_offset = int(self.query.get("offset") or 0)
+
+        while self.rows_loaded < cap:
+            limit = min(self.page_size, cap - self.rows_loaded)
+            if probe and limit == cap - self.rows_loaded:
+                limit += 1
+            page_query = {**self.query, "limit": limit, "offset": base_offset + self.rows_loaded}
+            body = None
+            async for event, payload in self._poll_page(page_query, deadline):
+                if event == "progress":
+                    yield event, payload
+                else:
+                    body = payload
+            if body is None:
+                return
+
+            rows = body.pop("data", None) or []
+            if self.pages_loaded == 0:
+                self.response = body
+            self.pages_loaded += 1
+            if self.rows_loaded + len(rows) > cap:
+                rows = rows[:cap - self.rows_loaded]
+                self.truncated = True
+            self.rows_loaded += len(rows)
+            if rows:
+                yield "rows", rows
+            if self.truncated or len(rows) < limit:
+                return
+
+    async def _poll_page(self, page_query: dict, deadline: float):
+        """Yields ("progress", info) while Cube.js asks to continue waiting, then ("page", body or None)."""
+        start = time.monotonic()
+        delay = CUBEJS_WAIT_INITIAL
+        while True:
+            body = await self._read_page(page_query)
+            if body is None or body.get("error") is None:
+                yield "page", body
+                return
+            if body["error"] != CONTINUE_WAIT:
+                yield "page", self._fail(200, f"Cube.js error: {body['error']}")
+                return
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"Cube.js query still running after {self.wait_timeout:g}s, giving up: {page_query}")
+                yield "page", self._fail(504, f"Cube.js query did not finish within {self.wait_timeout:g} seconds.")
+                return
+            self.waits += 1
+            cubejs_client.metrics["load"].waits += 1
+            yield "progress", {"stage": body.get("stage"), "waited_seconds": round(time.monotonic() - start, 1),
+                               "polls": self.waits, "rows_loaded": self.rows_loaded}
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, CUBEJS_WAIT_MAX)
+
+    async def _read_page(self, page_query: dict):
+        """Body of one /load page as a dict, or None if loading should stop."""
+        try:
+            response = await cubejs_client.arequest("POST", "load", stream=True, json={"query": page_query})
+        except httpx.HTTPError as e:
+            return self._fail(None, f"An error occurred while connecting to Cube.js API. Error: {str(e)}")
+        try:
+            if response.status_code != 200:
+                return self._fail(response.status_code, _load_error_message(response.status_code))
+            chunks = []
+            async for chunk in response.aiter_bytes():
+                self.bytes_loaded += len(chunk)
+                if self.bytes_loaded > self.max_bytes:
+                    # The partial page cannot be parsed; keep the pages already yielded
+                    logger.warning(f"Cube.js /load stopped at the {self.max_bytes} byte budget after {self.rows_loaded} rows.")
+                    self.truncated = True
+                    return self._fail(200, "Cube.js result exceeds the size limit.") if not self.pages_loaded else None
+                chunks.append(chunk)
+            self.status_code = 200
+            return json.loads(b"".join(chunks))
+        except httpx.HTTPError as e:
+            return self._fail(None, f"An error occurred while connecting to Cube.js API. Error: {str(e)}")
+        except ValueError as e:
+            return self._fail(response.status_code, f"Invalid response from Cube.js API. Error: {str(e)}")
+        finally:
+            await response.aclose()
+
+    def _fail(self, status_code, message):
+        if self.pages_loaded:
+            # Rows already handed out stay valid; report the result as cut short
+            logger.error(f"Cube.js /load failed after {self.rows_loaded} rows: {message}")
+            self.truncated = True
+        else:
+            self.status_code, self.error = status_code, message
+        return None
+
+
+async def get_data_from_cubejs(query):
+    """Loads every row of `query` within the row and byte budgets. Returns (status_code, response or error message)."""
+    try:
+        load = CubeJSLoad(query)
+        rows = [row async for page in load.pages() for row in page]
+        if load.error:
+            return load.status_code, load.error
+        if not rows and not load.response:
+            return load.status_code, "No data returned from Cube.js."
+        data = {**load.response, "data": rows}
+        if load.truncated:
+            data["truncated"] = True
+        return load.status_code, data
 
     except Exception as e:
         # Handle any other unexpected errors
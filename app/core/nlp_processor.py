@@ -1,87 +1,257 @@
 # nlp_processor.py
 
-from app.core.cubejs_client import load_cube_models_and_views, get_sql_from_cubejs, get_data_from_cubejs
-from app.utils.helpers import generate_cube_query, format_data_with_openai
+from app.core.cubejs_client import get_sql_from_cubejs, CubeJSLoad
+from app.core.schema_cache import schema_cache
+from app.core.response_cache import response_cache, refresh_key_of
+from app.utils.helpers import (
+    generate_cube_query, astream_format_data_with_openai, summarize_data, parse_json_field, chunk_data,
+    FormattingError, FORMAT_ERROR_MESSAGE
+)
 from app.utils.logger import logger
-from app.vector_store.store_manager import search_similar_queries, add_query_to_vector_store
+from app.vector_store.embedding_cache import normalize_text
+from app.vector_store.result_codec import encode_rows
+from app.vector_store.store_manager import (
+    asearch_similar_queries_with_distances, asearch_similar_queries_batch, aadd_query_to_vector_store, aembed_query, aembed_queries
+)
 from datetime import datetime
+import asyncio
 import json
-def process_nlp_query(user_query: str) -> tuple:
-    cube_models, cube_views = load_cube_models_and_views()
+import os
+
+STREAM_ROWS_PER_EVENT = int(os.getenv("STREAM_ROWS_PER_EVENT", "100"))  # Result rows per "rows" event
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # Batch questions generated and loaded at once
+SIMILAR_QUERIES_K = 5      # Neighbours used to augment the question
+PREVIOUS_RESPONSES_K = 15  # Neighbours shown to the LLM; one search serves both
+
+
+async def _revalidated(cached: dict):
+    """
+    `cached` if Cube.js still reports the refresh key its answer was computed from, else None.
+    Asks Cube.js for the first page of the answer's query, which its own result cache serves, at most
+    every RESPONSE_CACHE_REVALIDATE seconds per query. If Cube.js cannot be reached the answer is kept.
+    """
+    if cached is None or not cached.get("cubejs_query") or not response_cache.needs_revalidation(cached["cubejs_query"]):
+        return cached
+    try:
+        load = CubeJSLoad(json.loads(cached["cubejs_query"]))
+        events = load.events()
+        async for event, _ in events:
+            if event == "rows":
+                break
+        await events.aclose()
+    except Exception as e:
+        logger.warning(f"Could not revalidate cached answer, serving it: {str(e)}")
+        return cached
+    if load.error or not load.pages_loaded:
+        return cached
+    response_cache.observe_refresh_key(cached["cubejs_query"], refresh_key_of(load.response))
+    if not response_cache.is_current(cached):
+        logger.info(f"Cached answer for request {cached['request_id']} is stale; Cube.js data was refreshed.")
+        return None
+    return cached
+
+
+async def process_nlp_query(user_query: str, query_embedding=None, similar_queries=None) -> tuple:
+    """Run the full pipeline and return (formatted_data, request_id)."""
+    payload = await _run_nlp_query(user_query, query_embedding, similar_queries)
+    return payload["formatted_data"], payload["request_id"]
+
+
+async def _run_nlp_query(user_query: str, query_embedding=None, similar_queries=None) -> dict:
+    async for event, payload in stream_nlp_query(user_query, query_embedding, similar_queries):
+        if event == "done":
+            return payload
+
+
+async def process_nlp_queries(user_queries: list) -> list:
+    """
+    Batch variant of process_nlp_query. Identical questions are answered once, the remaining
+    questions are embedded in one call and searched with one FAISS query, and at most
+    BATCH_CONCURRENCY questions are generated and loaded from Cube.js at a time.
+    Returns one result dict per input question, in order.
+    """
+    unique_queries = list(dict.fromkeys(normalize_text(query) for query in user_queries))
+    originals = {}
+    for query in user_queries:
+        originals.setdefault(normalize_text(query), query)
+
+    results = {}
+    pending = []
+    revalidated = await asyncio.gather(*(_revalidated(response_cache.get_exact(originals[key])) for key in unique_queries))
+    for key, cached in zip(unique_queries, revalidated):
+        if cached:
+            results[key] = {"formatted_data": cached["answer"], "request_id": cached["request_id"], "status": "cached"}
+        else:
+            pending.append(key)
+
+    if pending:
+        # Load the schema once up front so a cold cache is not fetched by every task
+        await schema_cache.aget()
+        pending_queries = [originals[key] for key in pending]
+        query_embeddings = await aembed_queries(pending_queries)
+        similar = await asearch_similar_queries_batch(query_embeddings, k=PREVIOUS_RESPONSES_K)
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def run(key, query_embedding, similar_queries):
+            async with semaphore:
+                try:
+                    payload = await _run_nlp_query(originals[key], query_embedding, similar_queries or [])
+                    status = "cached" if payload.get("cached") else payload.get("status", "pass")
+                    results[key] = {"formatted_data": payload["formatted_data"], "request_id": payload["request_id"], "status": status}
+                except Exception as e:
+                    logger.error(f"Error processing batch query '{originals[key]}': {str(e)}")
+                    results[key] = {"formatted_data": None, "request_id": None, "status": "error", "error": str(e)}
+
+        await asyncio.gather(*(run(key, *args) for key, args in zip(pending, zip(query_embeddings, similar))))
+
+    logger.info(f"Processed batch of {len(user_queries)} queries ({len(unique_queries)} unique, {len(pending)} not cached).")
+    return [{"query": query, **results[normalize_text(query)]} for query in user_queries]
+
+
+async def stream_nlp_query(user_query: str, query_embedding=None, similar_queries=None):
+    """
+    Run the pipeline as an async generator of (event, payload) pairs, emitted as each stage completes:
+    "query" (the generated Cube.js query), "progress" (while Cube.js is still computing the result),
+    "rows" (result rows in chunks), "token" (answer text as it is generated) and finally "done" with
+    the complete answer.
+
+    `query_embedding` and `similar_queries` ((record, distance) pairs, nearest first) may be passed
+    in when they were already computed for a batch.
+    """
+    # **Step 0: Cache - Repeated questions are answered without any embedding or LLM call**
+    cached = await _revalidated(response_cache.get_exact(user_query))
+    if cached:
+        logger.info(f"Exact response cache hit for query: {user_query}")
+        yield "done", {"formatted_data": cached["answer"], "request_id": cached["request_id"], "cached": True}
+        return
+
+    # Embed the user query once; the vector is reused for every search and store below
+    if query_embedding is None:
+        query_embedding = await aembed_query(user_query)
+
+    # **Step 1: Retrieval - Search for similar queries in the vector store**
+    if similar_queries is None:
+        similar_queries = await asearch_similar_queries_with_distances(user_query, k=PREVIOUS_RESPONSES_K, query_embedding=query_embedding)
+
+    # A near-identical question with a highly rated answer is reused as is
+    cached = await _revalidated(response_cache.get_semantic(similar_queries))
+    if cached:
+        logger.info(f"Semantic response cache hit for query: {user_query}")
+        yield "done", {"formatted_data": cached["answer"], "request_id": cached["request_id"], "cached": True}
+        return
+    response_cache.record_miss()
+
+    cube_models, cube_views = await schema_cache.aget()
     if not cube_models or not cube_views:
         raise ValueError("Could not load Cube.js models or views")
 
-    # **Step 1: Retrieval - Search for similar queries in the vector store**
-    similar_queries = search_similar_queries(user_query, k=5)
     previous_queries_info = []
 
     # Collect similar queries, feedback, and ratings
     if similar_queries:
-        for similar_query in similar_queries:
-            # Ensure that similar_query is a dictionary and has expected keys
-            response_metadata = similar_query.get('metadata', {})
-            feedback = response_metadata.get('feedback', None)
-            rating = feedback.get('rating') if feedback else None
-            cubejs_query = response_metadata.get('cubejs_query', None)
-            data = response_metadata.get('data', None)
-            error_message = response_metadata.get('error_message', None)
+        for similar_query, _ in similar_queries[:SIMILAR_QUERIES_K]:
+            feedback = parse_json_field(similar_query.get('feedback'))
+            rating = feedback.get('rating') if isinstance(feedback, dict) else None
 
             previous_queries_info.append({
                 'query': similar_query.get('query', None),
                 'rating': rating,
                 'feedback': feedback,
-                'cubejs_query': cubejs_query,
-                'data': data,
-                'error_message': error_message
+                'cubejs_query': similar_query.get('response', None),
+                'data_summary': similar_query.get('data_summary', None),
+                'error_message': similar_query.get('error_message', None)
             })
 
     # **Step 2: Augmentation - Enhance the user query if relevant previous queries are found**
     augmented_query = augment_user_query(user_query, previous_queries_info)
 
     # **Step 3: Generation - Generate a new Cube.js query based on the augmented query**
-    cubejs_query, request_id = generate_cube_query(augmented_query, cube_models, cube_views)
+    if augmented_query == user_query:
+        augmented_embedding = query_embedding
+        previous_responses = [record for record, _ in similar_queries or []]
+    else:
+        augmented_embedding, previous_responses = None, None
+    cubejs_query, request_id = await generate_cube_query(augmented_query, cube_models, cube_views, query_embedding=augmented_embedding,
+                                                       schema_version=schema_cache.schema_hash, previous_responses=previous_responses)
     logger.info("Generated request ID: %s", request_id)
 
     if cubejs_query:
-        # **Step 4: Get data from Cube.js using the generated query**
-        status_code, data = get_data_from_cubejs(cubejs_query)
-        logger.info("Data from Cube load API : %s", data)
+        yield "query", {"request_id": request_id, "cubejs_query": cubejs_query}
+
+        # **Step 4: Get data from Cube.js using the generated query, streaming rows page by page**
+        load = CubeJSLoad(cubejs_query)
+        extracted_data = []
+        try:
+            async for event, payload in load.events():
+                if event == "progress":
+                    yield "progress", payload
+                    continue
+                extracted_data.extend(payload)
+                for rows in chunk_data(payload, STREAM_ROWS_PER_EVENT):
+                    yield "rows", {"rows": rows}
+        except Exception as e:
+            load.status_code, load.error = None, f"An unexpected error occurred. Error: {str(e)}"
+        logger.info(f"Loaded {load.rows_loaded} rows ({load.bytes_loaded} bytes, {load.pages_loaded} pages) from Cube.js"
+                    f"{' (truncated)' if load.truncated else ''}.")
 
         # Extract the relevant data from the response
-        if status_code == 200 and data and 'data' in data:
-            extracted_data = data['data']
-            # Format the extracted data as a string
-            formatted_data = format_data_with_openai(user_query, data)  # Convert list of dicts to a JSON string
-            status = "pass"
-            error_message = None
+        refresh_key = None
+        if load.error is None and load.pages_loaded:
+            data = {**load.response, "data": extracted_data}
+            if load.truncated:
+                data["truncated"] = True
+
+            refresh_key = refresh_key_of(data)
+            response_cache.observe_refresh_key(cubejs_query, refresh_key)
+
+            # Format the extracted data as a string, streaming the answer as it is generated
+            tokens = []
+            try:
+                async for token in astream_format_data_with_openai(user_query, data):
+                    tokens.append(token)
+                    yield "token", {"text": token}
+                formatted_data = "".join(tokens).strip()
+                status = "pass"
+                error_message = None
+                # Only complete answers are reused
+                response_cache.put(user_query, formatted_data, request_id, cubejs_query, refresh_key)
+            except FormattingError as e:
+                # A partial or failed answer is replaced by the error text in the "done" event
+                formatted_data = FORMAT_ERROR_MESSAGE
+                status = "fail"
+                error_message = f"Error formatting response: {str(e)}"
         else:
             extracted_data = None
             formatted_data = "No data available"
             status = "fail"
-            error_message = data if status_code else "Unable to generate data from Cube.js query."
+            error_message = load.error if load.status_code else "Unable to generate data from Cube.js query."
 
         # Store both the Cube.js query and the data in the vector store with enhanced metadata
-        add_query_to_vector_store(
+        await aadd_query_to_vector_store(
             user_query,
             cubejs_query,
             metadata={
                 "status": status,                # 'pass' or 'fail'
                 "error_message": error_message,  # Error message if failed
                 "cubejs_query": cubejs_query,    # Cube.js query
-                "data": extracted_data,          # Actual data or None if failure
+                "data": encode_rows(extracted_data, truncated=load.truncated),  # Column-wise rows, or None if failure
+                "data_summary": summarize_data(extracted_data),  # Compact rendering reused in later prompts
+                "formatted_data": formatted_data if status == "pass" else None,  # Answer reused by the response cache
+                "refresh_key": refresh_key,      # Cube.js refresh keys the answer was computed from
                 "feedback": None,                # Initial feedback is None
                 "similar_queries_info": previous_queries_info,  # Include info on similar queries
                 "request_id": request_id,        # Unique request ID
                 "timestamp": str(datetime.utcnow()),  # Timestamp of when the query was processed
-            }
+            },
+            query_embedding=query_embedding
         )
 
         # Return the formatted data and request ID
-        return formatted_data, request_id
+        yield "done", {"formatted_data": formatted_data, "request_id": request_id, "status": status}
 
     else:
         error_message = "Unable to generate Cube.js query."
-        add_query_to_vector_store(
+        await aadd_query_to_vector_store(
             user_query,
             cubejs_query,
             metadata={
@@ -93,10 +263,11 @@ def process_nlp_query(user_query: str) -> tuple:
                 "similar_queries_info": previous_queries_info,  # Include info on similar queries
                 "request_id": request_id,        # Unique request ID
                 "timestamp": str(datetime.utcnow()),  # Timestamp
-            }
+            },
+            query_embedding=query_embedding
         )
         # Return the error message and request ID
-        return error_message, request_id
+        yield "done", {"formatted_data": error_message, "request_id": request_id, "status": "fail"}
 
 
 
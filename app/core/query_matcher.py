@@ -0,0 +1,218 @@
+#query_matcher.py
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from app.core.schema_retriever import schema_version_of
+from app.utils.logger import logger
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() in ("1", "true", "yes")  # Answer simple questions without the LLM
+FAST_PATH_LIMIT = int(os.getenv("FAST_PATH_LIMIT", "1000"))  # Row limit of grouped fast-path queries
+SCHEMA_VERSIONS_KEPT = 2
+
+STOPWORDS = {
+    "a", "an", "the", "of", "is", "are", "was", "were", "what", "whats", "how", "show", "me", "list", "give", "get",
+    "tell", "find", "all", "our", "we", "do", "does", "have", "there", "in", "for", "with", "on", "to", "please", "value",
+    "values", "current", "overall", "and", "by", "per", "each", "every", "across", "view", "cube",
+}
+# Words with the same meaning in questions and member names
+CANONICAL = {"avg": "average", "mean": "average", "number": "count", "many": "count", "sum": "total", "qty": "quantity"}
+AGGREGATION_WORDS = {"count": {"count"}, "countDistinct": {"count", "distinct", "unique"}, "sum": {"total"},
+                     "avg": {"average"}, "min": {"minimum", "lowest"}, "max": {"maximum", "highest"}}
+GRANULARITIES = ("second", "minute", "hour", "day", "week", "month", "quarter", "year")
+GROUP_WORDS = ("by", "per", "each", "every")
+
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased, singular word tokens; camelCase and snake_case names are split into words."""
+    text = re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", str(text or "")).replace("'", "")
+    return [CANONICAL.get(_stem(token), _stem(token)) for token in re.findall(r"[a-z0-9]+", text.lower())]
+
+
+def _content(tokens) -> set:
+    return {token for token in tokens if token not in STOPWORDS}
+
+
+def _value_synonyms(member: dict) -> Dict[str, str]:
+    """Synonym -> possible value pairs, from a mapping or a list of one-pair mappings."""
+    synonyms = member.get("synonyms") or (member.get("meta") or {}).get("synonyms") or []
+    pairs = {}
+    for entry in synonyms if isinstance(synonyms, list) else [synonyms]:
+        if isinstance(entry, dict):
+            pairs.update({str(k): str(v) for k, v in entry.items()})
+    return pairs
+
+
+class QueryMatcher:
+    """
+    Deterministic fast path in front of the query-generation LLM.
+
+    Indexes the tokens of each view's member names, titles, possible values and synonyms, and builds a
+    Cube.js query directly when a question is fully explained by the schema: exactly one best measure,
+    optionally grouped "by" dimensions or a time granularity and filtered on listed values. Any word
+    the schema does not explain (dates, rankings, comparisons) sends the question to the LLM.
+    """
+
+    def __init__(self, enabled: bool = FAST_PATH_ENABLED):
+        self.enabled = enabled
+        self._versions = OrderedDict()  # schema version -> per-view index
+        self._lock = threading.Lock()
+        self._stats = {"matches": 0, "misses": 0}
+
+    def match(self, question: str, cube_views: dict, schema_version: Optional[str] = None) -> Optional[dict]:
+        """A Cube.js query for `question`, or None if it cannot be answered with confidence."""
+        if not self.enabled or not cube_views:
+            return None
+        views = self._index(schema_version or schema_version_of(cube_views), cube_views)
+        cubejs_query = self._match(question, views)
+        with self._lock:
+            self._stats["matches" if cubejs_query else "misses"] += 1
+        if cubejs_query:
+            logger.info(f"Fast path matched query '{question}': {cubejs_query}")
+        return cubejs_query
+
+    def _index(self, schema_version: str, cube_views: dict) -> list:
+        with self._lock:
+            if schema_version in self._versions:
+                return self._versions[schema_version]
+
+        views = []
+        for view_name, details in cube_views.items():
+            measures = []
+            for member in details.get("measures", []):
+                required = [_content(tokenize(member["name"].split(".", 1)[-1]))]
+                required += [_content(tokenize(synonym)) for synonym in member.get("synonyms") or [] if isinstance(synonym, str)]
+                optional = _content(tokenize(f"{member.get('title') or ''} {member.get('shortTitle') or ''}"))
+                optional |= AGGREGATION_WORDS.get(member.get("aggType") or member.get("type"), set())
+                measures.append({"name": member["name"], "required": [r for r in required if r], "optional": optional})
+
+            dimensions, values = [], []
+            for member in details.get("dimensions", []):
+                if member.get("type") != "time":
+                    dimensions.append({"name": member["name"], "tokens": _content(tokenize(member["name"].split(".", 1)[-1]))})
+                possible = member.get("possibleValues") or []
+                phrases = {value: value for value in possible if isinstance(value, str)}
+                phrases.update({synonym: value for synonym, value in _value_synonyms(member).items() if value in possible})
+                for phrase, value in phrases.items():
+                    tokens = tokenize(phrase)
+                    if tokens:
+                        values.append({"member": member["name"], "tokens": tokens, "value": value})
+
+            views.append({
+                "name": view_name,
+                "tokens": _content(tokenize(view_name)),
+                "measures": measures,
+                "dimensions": dimensions,
+                "time_dimensions": details.get("timeDimensions") or [],
+                # Longest phrases first so "home automation" wins over "home"
+                "values": sorted(values, key=lambda v: -len(v["tokens"])),
+            })
+
+        with self._lock:
+            self._versions[schema_version] = views
+            while len(self._versions) > SCHEMA_VERSIONS_KEPT:
+                self._versions.popitem(last=False)
+        return views
+
+    def _match(self, question: str, views: list) -> Optional[dict]:
+        tokens = tokenize(question)
+        candidates = []
+        for view in views:
+            result = self._match_view(tokens, view)
+            if result:
+                candidates.append(result)
+        if not candidates:
+            return None
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        if len(candidates) > 1 and candidates[0][0] == candidates[1][0]:
+            return None  # Equally good answers from different views
+        return candidates[0][1]
+
+    def _match_view(self, tokens: List[str], view: dict):
+        # Split off "by X and Y" grouping phrases
+        group_phrases, body = [], []
+        for token in tokens:
+            if token in GROUP_WORDS:
+                group_phrases.append([])
+            elif group_phrases and token == "and":
+                group_phrases.append([])
+            elif group_phrases:
+                group_phrases[-1].append(token)
+            else:
+                body.append(token)
+
+        # Filters on listed values, matched as whole phrases in the question body. Values of the same
+        # member form one "equals" filter, which Cube.js matches as any of them ("cameras and gaming")
+        filter_values, used = {}, set()
+        for entry in view["values"]:
+            size = len(entry["tokens"])
+            for start in range(len(body) - size + 1):
+                span = set(range(start, start + size))
+                if body[start:start + size] == entry["tokens"] and not span & used:
+                    values = filter_values.setdefault(entry["member"], [])
+                    if entry["value"] not in values:
+                        values.append(entry["value"])
+                    used |= span
+                    break
+        filters = [{"member": member, "operator": "equals", "values": values} for member, values in filter_values.items()]
+        remaining = _content(token for i, token in enumerate(body) if i not in used)
+
+        # The most specific measure whose name is fully present in the question
+        best, best_score = None, None
+        for measure in view["measures"]:
+            for required in measure["required"]:
+                if required <= remaining:
+                    score = len(required)
+                    if best_score is None or score > best_score:
+                        best, best_score, best_required = measure, score, required
+                    elif score == best_score and measure is not best:
+                        best = "ambiguous"
+        if best is None or best == "ambiguous":
+            return None
+        unexplained = remaining - best_required - best["optional"] - view["tokens"]
+        if unexplained:
+            return None
+
+        dimensions, time_dimensions = [], []
+        for phrase in group_phrases:
+            phrase = _content(phrase)
+            if not phrase:
+                return None
+            if len(phrase) == 1 and next(iter(phrase)) in GRANULARITIES:
+                if len(view["time_dimensions"]) != 1:
+                    return None
+                time_dimensions.append({"dimension": view["time_dimensions"][0], "granularity": next(iter(phrase))})
+                continue
+            matches = [d for d in view["dimensions"] if phrase <= d["tokens"] | view["tokens"]]
+            if len(matches) != 1:
+                return None
+            dimensions.append(matches[0]["name"])
+
+        cubejs_query = {"measures": [best["name"]], "dimensions": dimensions, "timeDimensions": time_dimensions}
+        if filters:
+            cubejs_query["filters"] = filters
+        if time_dimensions:
+            cubejs_query["order"] = {time_dimensions[0]["dimension"]: "asc"}
+        else:
+            cubejs_query["order"] = {best["name"]: "desc"}
+        if dimensions or time_dimensions:
+            cubejs_query["limit"] = FAST_PATH_LIMIT
+        # Prefer the view whose name the question mentions, then the more specific measure
+        score = (len(view["tokens"] & remaining), best_score)
+        return score, cubejs_query
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "enabled": self.enabled}
+
+
+query_matcher = QueryMatcher()
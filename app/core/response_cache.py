@@ -0,0 +1,169 @@
+#response_cache.py
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+from app.utils.helpers import parse_json_field
+from app.vector_store.embedding_cache import normalize_text
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # Seconds an answer is reused
+RESPONSE_CACHE_MAX_DISTANCE = float(os.getenv("RESPONSE_CACHE_MAX_DISTANCE", "0.05"))  # Squared L2 between normalized embeddings
+RESPONSE_CACHE_MIN_RATING = int(os.getenv("RESPONSE_CACHE_MIN_RATING", "4"))  # Feedback needed before an answer is reused
+RESPONSE_CACHE_REVALIDATE = float(os.getenv("RESPONSE_CACHE_REVALIDATE", "60"))  # Seconds between refresh-key checks per Cube.js query
+
+
+def refresh_key_of(cubejs_response: dict) -> Optional[str]:
+    """Identifies the state of the data behind a Cube.js /load response."""
+    if not isinstance(cubejs_response, dict):
+        return None
+    refresh_keys = cubejs_response.get("refreshKeyValues") or cubejs_response.get("lastRefreshTime")
+    return json.dumps(refresh_keys, sort_keys=True) if refresh_keys else None
+
+
+class ResponseCache:
+    """
+    Answer cache in front of process_nlp_query.
+
+    The exact tier maps normalized query text to the last successful answer; it is served once the
+    answer was rated at least RESPONSE_CACHE_MIN_RATING through rate_request. The semantic tier reuses
+    a stored history record whose embedding is within RESPONSE_CACHE_MAX_DISTANCE and whose answer
+    was rated as well. Entries expire after RESPONSE_CACHE_TTL and are dropped as soon as Cube.js
+    reports new refresh keys for the same Cube.js query. Keys are seen on every /load and, for hits,
+    by the caller re-checking them when needs_revalidation says so (see nlp_processor).
+    """
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._refresh_keys = {}  # Serialized Cube.js query -> latest refresh key seen
+        self._validated_at = {}  # Serialized Cube.js query -> time its refresh key was last seen
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0, "revalidations": 0}
+
+    def get_exact(self, query: str) -> Optional[dict]:
+        key = normalize_text(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not _well_rated(entry["rating"]):
+                return None
+            if entry is not None and self._is_fresh(entry["created_at"], entry["cubejs_query"], entry["refresh_key"]):
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return entry
+            if entry is not None:
+                del self._entries[key]
+        return None
+
+    def get_semantic(self, similar_queries: List[Tuple[dict, float]]) -> Optional[dict]:
+        """Picks the nearest highly rated, still fresh answer among (record, distance) search results."""
+        for record, distance in similar_queries or []:
+            if distance > RESPONSE_CACHE_MAX_DISTANCE:
+                break
+            feedback = parse_json_field(record.get("feedback"))
+            rating = feedback.get("rating") if isinstance(feedback, dict) else None
+            answer = record.get("formatted_data")
+            if record.get("status") != "pass" or not answer or not _well_rated(rating):
+                continue
+            created_at = _parse_timestamp(record.get("timestamp"))
+            cubejs_query = _serialize(parse_json_field(record.get("response")))
+            with self._lock:
+                if created_at is None or not self._is_fresh(created_at, cubejs_query, record.get("refresh_key")):
+                    continue
+                self._stats["semantic_hits"] += 1
+            return {"answer": answer, "request_id": record.get("request_id"), "cubejs_query": cubejs_query,
+                    "refresh_key": record.get("refresh_key")}
+        return None
+
+    def record_miss(self):
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def put(self, query: str, answer: str, request_id: str, cubejs_query, refresh_key: Optional[str]):
+        cubejs_query = _serialize(cubejs_query)
+        with self._lock:
+            self._entries[normalize_text(query)] = {
+                "answer": answer,
+                "request_id": request_id,
+                "cubejs_query": cubejs_query,
+                "refresh_key": refresh_key,
+                "rating": None,
+                "created_at": time.time(),
+            }
+            self._entries.move_to_end(normalize_text(query))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def observe_refresh_key(self, cubejs_query, refresh_key: Optional[str]):
+        """Records the refresh key of a fresh /load; cached answers for the same query with another key become stale."""
+        if refresh_key is None:
+            return
+        cubejs_query = _serialize(cubejs_query)
+        with self._lock:
+            self._refresh_keys[cubejs_query] = refresh_key
+            self._validated_at[cubejs_query] = time.time()
+
+    def needs_revalidation(self, cubejs_query) -> bool:
+        """Whether a hit for this Cube.js query should re-check its refresh key with Cube.js first."""
+        with self._lock:
+            return time.time() - self._validated_at.get(_serialize(cubejs_query), 0.0) >= RESPONSE_CACHE_REVALIDATE
+
+    def is_current(self, cached: dict) -> bool:
+        """Whether a cached answer still matches the latest refresh key seen for its Cube.js query."""
+        with self._lock:
+            self._stats["revalidations"] += 1
+            latest_key = self._refresh_keys.get(cached["cubejs_query"])
+            if latest_key is None or cached.get("refresh_key") is None or latest_key == cached["refresh_key"]:
+                return True
+            self._stats["invalidations"] += 1
+            for key in [k for k, entry in self._entries.items() if entry["cubejs_query"] == cached["cubejs_query"]]:
+                del self._entries[key]
+            return False
+
+    def rate_request(self, request_id: str, rating: int):
+        """Applies feedback to exact-tier answers: well rated ones become servable, poorly rated ones are dropped."""
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry["request_id"] == request_id]:
+                if _well_rated(rating):
+                    self._entries[key]["rating"] = rating
+                else:
+                    del self._entries[key]
+                    self._stats["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "size": len(self._entries), "ttl_seconds": self.ttl}
+
+    def _is_fresh(self, created_at: float, cubejs_query: Optional[str], refresh_key: Optional[str]) -> bool:
+        if time.time() - created_at > self.ttl:
+            return False
+        latest_key = self._refresh_keys.get(cubejs_query)
+        if latest_key is not None and refresh_key is not None and latest_key != refresh_key:
+            self._stats["invalidations"] += 1
+            return False
+        return True
+
+
+def _well_rated(rating) -> bool:
+    return bool(rating) and rating >= RESPONSE_CACHE_MIN_RATING
+
+
+def _serialize(cubejs_query) -> Optional[str]:
+    if cubejs_query is None or isinstance(cubejs_query, str):
+        return cubejs_query
+    return json.dumps(cubejs_query, sort_keys=True)
+
+
+def _parse_timestamp(timestamp: Optional[str]) -> Optional[float]:
+    # Timestamps are stored as str(datetime.utcnow())
+    try:
+        return (datetime.fromisoformat(timestamp) - datetime(1970, 1, 1)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,116 @@
+#schema_cache.py
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from app.core.cubejs_client import fetch_cube_meta, parse_cube_meta
+from app.utils.logger import logger
+
+SCHEMA_CACHE_TTL = float(os.getenv("CUBEJS_SCHEMA_TTL", "300"))  # Seconds between background refreshes
+
+
+class SchemaCache:
+    """
+    Process-wide cache of the parsed Cube.js schema.
+
+    The schema is fetched at startup and refreshed by a background thread every `ttl` seconds.
+    A refresh only re-parses the schema when the /meta document hash changes, and a failed
+    refresh keeps serving the last good schema.
+    """
+
+    def __init__(self, ttl: float = SCHEMA_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._models = None
+        self._views = None
+        self._schema_hash = None
+        self._loaded_at = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "refresh_failures": 0, "schema_changes": 0}
+
+    def get(self) -> tuple:
+        """Return (models, views), loading synchronously only if nothing has been cached yet."""
+        with self._lock:
+            if self._views is not None:
+                self._stats["hits"] += 1
+                return self._models, self._views
+            self._stats["misses"] += 1
+
+        self.refresh()
+        with self._lock:
+            return self._models, self._views
+
+    async def aget(self) -> tuple:
+        """Async variant of get(); a cold-cache load runs in a worker thread instead of on the event loop."""
+        with self._lock:
+            if self._views is not None:
+                self._stats["hits"] += 1
+                return self._models, self._views
+        return await asyncio.to_thread(self.get)
+
+    def refresh(self) -> bool:
+        """Fetch /meta and swap in the new schema. Returns False if Cube.js could not be reached."""
+        try:
+            cubejs_meta = fetch_cube_meta()
+        except Exception as e:
+            with self._lock:
+                self._stats["refresh_failures"] += 1
+            logger.error(f"Schema refresh failed, serving last good schema: {str(e)}")
+            return False
+
+        schema_hash = hashlib.sha256(json.dumps(cubejs_meta, sort_keys=True).encode("utf-8")).hexdigest()
+        if schema_hash != self._schema_hash:
+            models, views = parse_cube_meta(cubejs_meta)
+            with self._lock:
+                self._models, self._views = models, views
+                self._schema_hash = schema_hash
+                self._stats["schema_changes"] += 1
+            logger.info(f"Cube.js schema updated (hash {schema_hash[:12]}).")
+
+        with self._lock:
+            self._loaded_at = time.time()
+            self._stats["refreshes"] += 1
+        return True
+
+    @property
+    def schema_hash(self):
+        return self._schema_hash
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "schema_hash": self._schema_hash,
+                "age_seconds": round(time.time() - self._loaded_at, 3) if self._loaded_at else None,
+                "ttl_seconds": self.ttl,
+            }
+
+    def start(self, wait: bool = True):
+        """
+        Start the background refresh thread. With `wait`, the schema is loaded before returning;
+        otherwise the thread loads it first, and requests arriving before then load it themselves.
+        """
+        if wait:
+            self.refresh()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, args=(not wait,), name="cube-schema-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _refresh_loop(self, refresh_first: bool = False):
+        if refresh_first:
+            self.refresh()
+        while not self._stop_event.wait(self.ttl):
+            self.refresh()
+
+
+schema_cache = SchemaCache()
@@ -0,0 +1,152 @@
+#schema_retriever.py
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from app.utils.logger import logger
+from app.utils.resources import resources
+
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", "25"))  # Members sent to the LLM per question
+SCHEMA_MAX_VALUES = int(os.getenv("SCHEMA_MAX_VALUES", "20"))  # possibleValues/synonyms kept per dimension
+SCHEMA_VERSIONS_KEPT = 2  # Member embeddings kept for the current and the previous schema
+
+MEMBER_KINDS = ("measures", "dimensions")
+
+
+def schema_version_of(cube_views: dict) -> str:
+    return hashlib.sha256(json.dumps(cube_views, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def member_text(view_name: str, member: dict) -> str:
+    """Text embedded for a view member: its name, titles, description and synonyms."""
+    parts = [view_name, member.get("name"), member.get("title"), member.get("shortTitle"), member.get("description")]
+    parts += member.get("synonyms") or []
+    return " | ".join(str(part) for part in parts if part)
+
+
+def compact_member(member: dict) -> dict:
+    """Drops empty and repeated fields and caps long value lists."""
+    compact = {"name": member["name"]}
+    title = member.get("title")
+    if title:
+        compact["title"] = title
+    for key in ("description", "shortTitle"):
+        if member.get(key) and member[key] != title:
+            compact[key] = member[key]
+    for key in ("type", "aggType"):
+        if member.get(key):
+            compact[key] = member[key]
+    for key in ("possibleValues", "synonyms"):
+        if member.get(key):
+            compact[key] = member[key][:SCHEMA_MAX_VALUES]
+    extra_meta = {k: v for k, v in (member.get("meta") or {}).items() if k not in ("possibleValues", "synonyms")}
+    if extra_meta:
+        compact["meta"] = extra_meta
+    return compact
+
+
+def render_views(cube_views: dict, selected: Optional[set] = None) -> str:
+    """
+    Minified JSON of the views, limited to the `selected` (view, member name) pairs when given.
+    Views without a selected member are left out.
+    """
+    rendered = {}
+    for view_name, details in cube_views.items():
+        view = {}
+        for kind in MEMBER_KINDS:
+            members = [
+                compact_member(member) for member in details.get(kind, [])
+                if selected is None or (view_name, member["name"]) in selected
+            ]
+            if members:
+                view[kind] = members
+        if not view:
+            continue
+        if details.get("timeDimensions"):
+            view["timeDimensions"] = details["timeDimensions"]
+        rendered[view_name] = view
+    return json.dumps(rendered, separators=(",", ":"), ensure_ascii=False)
+
+
+class SchemaRetriever:
+    """
+    Picks the view members relevant to a question so the prompt carries only part of the schema.
+
+    Every measure and dimension is embedded once per schema version; a question is matched against
+    those embeddings by cosine similarity and the `top_k` members are rendered compactly.
+    """
+
+    def __init__(self, top_k: int = SCHEMA_TOP_K):
+        self.top_k = top_k
+        self._versions = OrderedDict()  # schema version -> (member keys, normalized embedding matrix)
+        self._lock = threading.Lock()
+        self._build_lock = asyncio.Lock()
+        self._stats = {"builds": 0, "selections": 0, "full_renders": 0, "build_failures": 0}
+
+    async def render(self, cube_views: dict, query_embedding, schema_version: Optional[str] = None) -> str:
+        """Compact rendering of the members of `cube_views` most relevant to the query embedding."""
+        keys = [(view_name, member["name"]) for view_name, details in cube_views.items()
+                for kind in MEMBER_KINDS for member in details.get(kind, [])]
+        if self.top_k <= 0 or len(keys) <= self.top_k or query_embedding is None:
+            with self._lock:
+                self._stats["full_renders"] += 1
+            return render_views(cube_views)
+
+        schema_version = schema_version or schema_version_of(cube_views)
+        member_index = await self._member_index(schema_version, cube_views)
+        if member_index is None:
+            with self._lock:
+                self._stats["full_renders"] += 1
+            return render_views(cube_views)
+
+        member_keys, matrix = member_index
+        query = np.asarray(query_embedding, dtype="float32")
+        scores = matrix @ (query / (np.linalg.norm(query) or 1.0))
+        top = np.argpartition(-scores, self.top_k - 1)[:self.top_k]
+        with self._lock:
+            self._stats["selections"] += 1
+        return render_views(cube_views, {member_keys[i] for i in top})
+
+    async def _member_index(self, schema_version: str, cube_views: dict):
+        with self._lock:
+            if schema_version in self._versions:
+                return self._versions[schema_version]
+
+        async with self._build_lock:
+            with self._lock:
+                if schema_version in self._versions:
+                    return self._versions[schema_version]
+
+            member_keys, texts = [], []
+            for view_name, details in cube_views.items():
+                for kind in MEMBER_KINDS:
+                    for member in details.get(kind, []):
+                        member_keys.append((view_name, member["name"]))
+                        texts.append(member_text(view_name, member))
+            try:
+                vectors = np.asarray(await resources.embeddings.aembed_documents(texts), dtype="float32")
+            except Exception as e:
+                with self._lock:
+                    self._stats["build_failures"] += 1
+                logger.error(f"Error embedding schema members, sending the full schema: {str(e)}")
+                return None
+
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            with self._lock:
+                self._versions[schema_version] = (member_keys, vectors)
+                while len(self._versions) > SCHEMA_VERSIONS_KEPT:
+                    self._versions.popitem(last=False)
+                self._stats["builds"] += 1
+            logger.info(f"Embedded {len(member_keys)} schema members for schema version {schema_version[:12]}.")
+            return member_keys, vectors
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "top_k": self.top_k, "versions_cached": list(v[:12] for v in self._versions)}
+
+
+schema_retriever = SchemaRetriever()
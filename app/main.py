@@ -1,9 +1,54 @@
 #main.py
+import asyncio
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI,Request
 from app.api.routes import router as api_router
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-app = FastAPI()
+from app.core.schema_cache import schema_cache
+from app.core.cubejs_client import cubejs_client
+from app.utils.logger import logger
+from app.utils.resources import resources
+from app.vector_store.embedding_cache import embedding_cache
+from app.vector_store.store_manager import init_vector_store, save_faiss_index, store_executor, write_queue
+
+# Create the OpenAI clients and open the vector store at startup instead of on the first request
+WARM_ON_STARTUP = os.getenv("WARM_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+
+def warm_resources():
+    try:
+        resources.warm()
+        init_vector_store()
+        logger.info("Resources warmed.")
+    except Exception as e:
+        logger.error(f"Error warming resources, they will load on first use: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the Cube.js schema cache and keep it fresh in the background
+    schema_cache.start(wait=False)
+    # Heavy resources load in a worker thread, so the server accepts connections right away
+    warm_task = asyncio.create_task(asyncio.to_thread(warm_resources)) if WARM_ON_STARTUP else None
+
+    yield
+
+    if warm_task is not None:
+        await warm_task
+    schema_cache.stop()
+    await cubejs_client.aclose()
+    # Write out records still queued for the vector store
+    write_queue.stop()
+    # Persist cached embeddings if EMBEDDING_CACHE_FILE is configured
+    embedding_cache.save()
+    # Fold the vector store log into a snapshot so the next startup has nothing to replay
+    store_executor.shutdown(wait=True)
+    save_faiss_index()
+
+
+app = FastAPI(lifespan=lifespan)
 # Load Cube.js semantic documents at startup
 # load_cube_semantic_docs()
 templates = Jinja2Templates(directory="templates")
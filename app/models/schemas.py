@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -17,3 +18,21 @@ class NLPQueryRequest(BaseModel):
 class NLPQueryResponse(BaseModel):
     query: str
     formatted_data: str
+
+
+# Schema for a batch of NLP queries
+class NLPBatchRequest(BaseModel):
+    queries: List[str]
+
+
+# Result for one question of a batch; status is "pass", "fail", "cached" or "error"
+class NLPBatchItem(BaseModel):
+    query: str
+    formatted_data: Optional[str] = None
+    request_id: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+
+
+class NLPBatchResponse(BaseModel):
+    results: List[NLPBatchItem]
@@ -1,53 +1,95 @@
 import json
-import os
 import uuid
-from langchain.prompts import PromptTemplate
-from langchain_core.documents import Document
-from langchain_openai import OpenAI
-from app.vector_store.store_manager import add_query_to_vector_store, search_similar_queries, filter_complex_metadata
+from app.core.query_matcher import query_matcher
+from app.core.schema_retriever import schema_retriever
+from app.vector_store.result_codec import decode_rows
+from app.vector_store.store_manager import aadd_query_to_vector_store, asearch_similar_queries, aembed_query
 
 from app.utils.logger import logger
+from app.utils.resources import resources
+from app.utils.result_renderer import render_rows, template_scalar_answer
 
-llm = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), temperature=0)
-
-def generate_cube_query(query: str, cube_models: dict, cube_views: dict) -> tuple:
+async def generate_cube_query(query: str, cube_models: dict, cube_views: dict, query_embedding=None, schema_version=None,
+                              previous_responses=None) -> tuple:
     logger.info(f"Generating Cube.js query for user query: {query}")
 
-    # Search for similar queries in the vector store
-    previous_responses = search_similar_queries(query, k=15)
+    # Questions that map directly onto the schema are answered without the LLM
+    cubejs_query = query_matcher.match(query, cube_views, schema_version=schema_version)
+    if cubejs_query is None:
+        cubejs_query, query_embedding = await _generate_cube_query_with_llm(query, cube_views, query_embedding,
+                                                                            schema_version, previous_responses)
+        if cubejs_query is None:
+            return None, None
+
+    # Remove empty filters
+    if "filters" in cubejs_query and not cubejs_query["filters"]:
+        del cubejs_query["filters"]
+
+    # Ensure an order field exists
+    if "order" not in cubejs_query:
+        cubejs_query["order"] = {"Orders.orderCount": "desc"}
+
+    logger.info(f"Generated Cube.js query: {cubejs_query}")
+
+    # Serialize the Cube.js query
+    serialized_query = json.dumps(cubejs_query)
+    if serialized_query is None:
+        logger.error("Failed to serialize cubejs_query")
+        return None, None
+
+    # Store the query and its metadata in the vector store
+    request_id = str(uuid.uuid4())
+    metadata = {
+        "response": serialized_query,  # Store the serialized Cube.js query
+        "request_id": request_id,
+        "success": True,
+        "feedback": None,
+        "cubejs_query": serialized_query  # Store the Cube.js query
+    }
+
+    # Add the query and its response to the vector store
+    await aadd_query_to_vector_store(query, serialized_query, metadata, query_embedding=query_embedding)
+
+    return cubejs_query, request_id
+
+async def _generate_cube_query_with_llm(query: str, cube_views: dict, query_embedding, schema_version, previous_responses) -> tuple:
+    """Cube.js query from the LLM and the query embedding it computed; the query is None if the output is not JSON."""
+    # Embed the query once and reuse the vector for the search and the store below
+    if query_embedding is None:
+        query_embedding = await aembed_query(query)
+
+    # Search for similar queries in the vector store, unless the caller already did
+    if previous_responses is None:
+        previous_responses = await asearch_similar_queries(query, k=15, query_embedding=query_embedding)
     logger.info("Previous Response: %s ", previous_responses)
 
-    # Collect previous responses for inclusion in the prompt
+    # Collect previous responses for inclusion in the prompt. Results are rendered from the
+    # summary stored with each record, so building this context makes no LLM calls.
     previous_responses_text = ""
     if previous_responses:
         for resp in previous_responses:
-            response_metadata = resp.get('metadata', {})
-            feedback = response_metadata.get('feedback', None)
-            rating = feedback.get('rating') if feedback else None
-            data = response_metadata.get('data', None)
-            cubejs_query = response_metadata.get('cubejs_query', None)
-            status = response_metadata.get('status', 'unknown')  # Add status retrieval
-
-            # Format the previous response data
-            if data:
-                formatted_data = format_data_with_openai(query, data)
-                previous_responses_text += (
-                    f"\nPrevious Query: {resp.get('query')}\n"
-                    f"Status: {status}\n"
-                    f"Rating: {rating}\n"
-                    f"Cube.js Query: {cubejs_query}\n"
-                    f"Data: {formatted_data}\n"
-                )
-            else:
-                previous_responses_text += (
-                    f"\nPrevious Query: {resp.get('query')}\n"
-                    f"Status: {status}\n"
-                    f"Rating: {rating}\n"
-                    f"Cube.js Query: {cubejs_query}\n"
-                    f"Data: No data available\n"
-                )
-
-    # Prepare the Cube.js query generation prompt
+            feedback = parse_json_field(resp.get('feedback'))
+            rating = feedback.get('rating') if isinstance(feedback, dict) else None
+            cubejs_query = resp.get('response')
+            status = resp.get('status', 'unknown')  # Add status retrieval
+            data_summary = resp.get('data_summary')
+            if data_summary is None and status == 'pass':
+                # Records stored before summaries existed
+                data_summary = summarize_data(decode_rows(resp.get('data')))
+
+            previous_responses_text += (
+                f"\nPrevious Query: {resp.get('query')}\n"
+                f"Status: {status}\n"
+                f"Rating: {rating}\n"
+                f"Cube.js Query: {cubejs_query}\n"
+                f"Data: {data_summary or 'No data available'}\n"
+            )
+
+    # Send only the view members relevant to the query, rendered compactly
+    relevant_views = await schema_retriever.render(cube_views, query_embedding, schema_version=schema_version)
+
+    # Prepare the Cube.js query generation prompt; langchain is imported on first use to keep app import fast
+    from langchain_core.prompts import PromptTemplate
     prompt = PromptTemplate(
         input_variables=["cube_views", "previous_responses", "query"],
         template="""
@@ -123,53 +165,49 @@ def generate_cube_query(query: str, cube_models: dict, cube_views: dict) -> tupl
     )
 
     # Generate the prompt and process the response
-    sequence = prompt | llm
+    sequence = prompt | resources.llm
     inputs = {
         "query": query,
-        "cube_views": json.dumps(cube_views, indent=4),
+        "cube_views": relevant_views,
         "previous_responses": previous_responses_text
     }
 
     logger.info(f"Generated prompt inputs: {inputs}")
-    response = sequence.invoke(inputs)
+    response = await sequence.ainvoke(inputs)
     logger.info(f"Raw response from OpenAI: {response}")
 
     try:
         cubejs_query = json.loads(response)
     except json.JSONDecodeError as e:
         logger.error(f"JSON decode error: {str(e)}. Response was: {response}")
-        return None, None
-
-    # Remove empty filters
-    if "filters" in cubejs_query and not cubejs_query["filters"]:
-        del cubejs_query["filters"]
-
-    # Ensure an order field exists
-    if "order" not in cubejs_query:
-        cubejs_query["order"] = {"Orders.orderCount": "desc"}
+        return None, query_embedding
+    return cubejs_query, query_embedding
 
-    logger.info(f"Generated Cube.js query: {cubejs_query}")
+def parse_json_field(value):
+    """Stored metadata keeps dicts and lists as JSON strings; decode them, passing other values through."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+    return value
 
-    # Serialize the Cube.js query
-    serialized_query = json.dumps(cubejs_query)
-    if serialized_query is None:
-        logger.error("Failed to serialize cubejs_query")
-        return None, None
 
-    # Store the query and its metadata in the vector store
-    request_id = str(uuid.uuid4())
-    metadata = {
-        "response": serialized_query,  # Store the serialized Cube.js query
-        "request_id": request_id,
-        "success": True,
-        "feedback": None,
-        "cubejs_query": serialized_query  # Store the Cube.js query
-    }
+def summarize_data(data, max_rows: int = 3) -> str:
+    """
+    Deterministic one-paragraph summary of Cube.js result rows for prompt context:
+    row count, columns and the first few rows.
+    """
+    if not data or not isinstance(data, list):
+        return None
+    columns = list(data[0].keys()) if isinstance(data[0], dict) else []
+    sample = "; ".join(
+        ", ".join(f"{key}={value}" for key, value in row.items()) for row in data[:max_rows] if isinstance(row, dict)
+    )
+    summary = f"{len(data)} row{'s' if len(data) != 1 else ''}. Columns: {', '.join(columns)}. "
+    summary += f"{'Rows' if len(data) <= max_rows else f'First {max_rows} rows'}: {sample}"
+    return summary
 
-    # Add the query and its response to the vector store
-    add_query_to_vector_store(query, serialized_query, metadata)
-
-    return cubejs_query, request_id
 
 def chunk_data(data, chunk_size=10):
     # Split the data into smaller chunks
@@ -177,55 +215,90 @@ def chunk_data(data, chunk_size=10):
         yield data[i:i + chunk_size]
 
 
-def format_data_with_openai(user_query: str, cubejs_data: dict) -> str:
-    try:
-        # Extract relevant data from the Cube.js response
-        if 'data' in cubejs_data and cubejs_data['data']:
-            data_points = cubejs_data['data']
-            formatted_data_points = [f"{key}: {value}" for item in data_points for key, value in item.items()]
-            formatted_data = "\n".join(formatted_data_points)
-        else:
-            formatted_data = "No data available"
-
-        # Prepare the prompt for OpenAI
-        prompt = PromptTemplate(
-            input_variables=["user_query", "data"],
-            template="""
-            You are an expert in providing concise and relevant responses based on data. Here is the user's query and the data obtained from Cube.js:
-            
-            User Query: "{user_query}"
-            
-            Data:
-            {data}
-            
-            Instructions:
-            - Format the response based strictly on the data provided. Do not generate additional details or fabricate information.
-            - If the data contains only counts or numerical values (e.g., product count), do not create a list of products.
-            - For lists of items or categories, use bullet points or numbered lists only if the data explicitly includes these details.
-            - If only summary information (e.g., product count) is available, state this clearly in the response.
-            - For tabular data, use a markdown table and ensure all rows are included exactly as they appear in the data.
-            - If there is insufficient data to answer the query fully, clearly state what is missing.
-            - Ensure the response is easy to understand, concise, and addresses the user's query completely.
-            
-            
-            Response:
-            """
-        )
+def _format_data_sequence(user_query: str, cubejs_data: dict):
+    """Prompt chain and inputs that turn Cube.js rows into the answer shown to the user."""
+    # Render the rows compactly within the token budget; large results become totals plus a sample
+    formatted_data = render_rows(cubejs_data)
+
+    # Prepare the prompt for OpenAI
+    from langchain_core.prompts import PromptTemplate
+    prompt = PromptTemplate(
+        input_variables=["user_query", "data"],
+        template="""
+        You are an expert in providing concise and relevant responses based on data. Here is the user's query and the data obtained from Cube.js:
+        
+        User Query: "{user_query}"
+        
+        Data:
+        {data}
+        
+        Instructions:
+        - Format the response based strictly on the data provided. Do not generate additional details or fabricate information.
+        - If the data contains only counts or numerical values (e.g., product count), do not create a list of products.
+        - For lists of items or categories, use bullet points or numbered lists only if the data explicitly includes these details.
+        - If only summary information (e.g., product count) is available, state this clearly in the response.
+        - For tabular data, use a markdown table and ensure all rows are included exactly as they appear in the data.
+        - If the data gives totals per column and only the first rows, answer from the totals and say that only the first rows are listed.
+        - If there is insufficient data to answer the query fully, clearly state what is missing.
+        - Ensure the response is easy to understand, concise, and addresses the user's query completely.
+        
+        
+        Response:
+        """
+    )
+
+    inputs = {
+        "user_query": user_query,
+        "data": formatted_data
+    }
+    logger.info(f"Generated prompt inputs: {inputs}")
+    return prompt | resources.llm, inputs
+
+
+FORMAT_ERROR_MESSAGE = "Error formatting response. Please try again later."
+
+
+class FormattingError(Exception):
+    """The answer could not be generated, or was cut off; it must not be cached or stored as an answer."""
+
 
+async def format_data_with_openai(user_query: str, cubejs_data: dict) -> str:
+    """Answer text for the Cube.js result. Raises FormattingError if the LLM call fails or returns nothing."""
+    templated = template_scalar_answer(cubejs_data)
+    if templated:
+        return templated
+    try:
         # Generate the formatted response
-        sequence = prompt | llm
-        inputs = {
-            "user_query": user_query,
-            "data": formatted_data
-        }
-
-        logger.info(f"Generated prompt inputs: {inputs}")
-        response = sequence.invoke(inputs)
+        sequence, inputs = _format_data_sequence(user_query, cubejs_data)
+        response = await sequence.ainvoke(inputs)
         logger.info(f"Raw response from OpenAI: {response}")
 
         formatted_response = response.strip()
-        return formatted_response
+    except Exception as e:
+        logger.error(f"Error formatting data with OpenAI: {str(e)}")
+        raise FormattingError(str(e)) from e
+    if not formatted_response:
+        raise FormattingError("The LLM returned an empty answer")
+    return formatted_response
 
+
+async def astream_format_data_with_openai(user_query: str, cubejs_data: dict):
+    """
+    Streaming variant of format_data_with_openai that yields the answer text chunk by chunk. Raises
+    FormattingError if the stream fails, including after some chunks were yielded, or is empty.
+    """
+    templated = template_scalar_answer(cubejs_data)
+    if templated:
+        yield templated
+        return
+    streamed = False
+    try:
+        sequence, inputs = _format_data_sequence(user_query, cubejs_data)
+        async for chunk in sequence.astream(inputs):
+            streamed = streamed or bool(chunk.strip())
+            yield chunk
     except Exception as e:
         logger.error(f"Error formatting data with OpenAI: {str(e)}")
-        return "Error formatting response. Please try again later."
+        raise FormattingError(str(e)) from e
+    if not streamed:
+        raise FormattingError("The LLM returned an empty answer")
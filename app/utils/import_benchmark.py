@@ -0,0 +1,84 @@
+"""
+Import-time benchmark for the application.
+
+Imports `app.main` in fresh interpreters without OpenAI credentials, reports the wall time and the
+slowest modules, and fails if the median import exceeds the budget, if a module that should load
+lazily was imported, or if the vector store was opened at import. Run it in CI or before a release:
+
+    python -m app.utils.import_benchmark
+    python -m app.utils.import_benchmark --runs 10 --budget 1.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that must only be imported when first used
+LAZY_MODULES = ("langchain_openai", "openai", "langchain", "langchain_core.prompts")
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+seconds = time.perf_counter() - start
+from app.vector_store import store_manager
+print(json.dumps({
+    "seconds": seconds,
+    "eager_modules": [m for m in %r if m in sys.modules],
+    "store_loaded": store_manager.index is not None,
+}))
+""" % (LAZY_MODULES,)
+
+
+def _run_once(cwd: str) -> tuple:
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD], cwd=cwd, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing app.main failed:\n{proc.stderr}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    modules = []
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                modules.append((int(cumulative), name.strip()))
+    return result, sorted(modules, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure and check the import time of app.main.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET", "1.5")),
+                        help="Maximum median import time in seconds")
+    parser.add_argument("--top", type=int, default=10, help="Slowest modules to list")
+    args = parser.parse_args()
+
+    cwd = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    runs = [_run_once(cwd) for _ in range(args.runs)]
+    median = statistics.median(result["seconds"] for result, _ in runs)
+    result, modules = runs[-1]
+
+    print(f"import app.main: median {median:.3f}s over {args.runs} runs (budget {args.budget:.3f}s)")
+    for cumulative, name in modules[:args.top]:
+        print(f"{cumulative / 1e6:>10.3f}s  {name}")
+
+    failures = []
+    if median > args.budget:
+        failures.append(f"median import time {median:.3f}s exceeds the {args.budget:.3f}s budget")
+    if result["eager_modules"]:
+        failures.append(f"imported at startup instead of on first use: {', '.join(result['eager_modules'])}")
+    if result["store_loaded"]:
+        failures.append("the vector store was opened at import")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#resources.py
+import os
+import threading
+from app.utils.logger import logger
+
+
+class Resources:
+    """
+    Container for the process-wide OpenAI clients and tokenizer. Each client, and the langchain_openai
+    import behind it, is created on first use, so importing the app needs neither the import time nor
+    credentials. The FastAPI lifespan warms them in the background at startup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._llm = None
+        self._embeddings = None
+        self._tokenizer = None  # tiktoken encoding; False if it could not be loaded
+        self._tokenizer_thread = None
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    from langchain_openai import OpenAI
+                    self._llm = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), temperature=0)
+        return self._llm
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    from langchain_openai import OpenAIEmbeddings
+                    self._embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+        return self._embeddings
+
+    @property
+    def tokenizer(self):
+        """The cl100k_base tiktoken encoding, or None if it cannot be loaded. May download it, so it blocks."""
+        if self._tokenizer is None:
+            try:
+                import tiktoken
+                self._tokenizer = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logger.warning(f"tiktoken encoding unavailable, token counts will be estimated: {str(e)}")
+                self._tokenizer = False
+        return self._tokenizer or None
+
+    def tokenizer_nowait(self):
+        """The tokenizer if already loaded; otherwise starts loading it in a background thread and returns None."""
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer_thread is None:
+                    self._tokenizer_thread = threading.Thread(target=lambda: self.tokenizer, name="tokenizer-loader", daemon=True)
+                    self._tokenizer_thread.start()
+            return None
+        return self._tokenizer or None
+
+    def warm(self):
+        """Creates every client and the tokenizer now instead of on the first request."""
+        return self.llm, self.embeddings, self.tokenizer
+
+
+resources = Resources()
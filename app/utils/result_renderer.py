@@ -0,0 +1,151 @@
+#result_renderer.py
+import csv
+import io
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+from app.utils.logger import logger
+from app.utils.resources import resources
+from app.vector_store.result_codec import parse_number
+
+FORMAT_TOKEN_BUDGET = int(os.getenv("FORMAT_TOKEN_BUDGET", "3000"))  # Tokens of result data sent to the answer LLM
+FORMAT_TEMPLATE_SCALARS = os.getenv("FORMAT_TEMPLATE_SCALARS", "true").lower() in ("1", "true", "yes")  # Answer single-row numbers without the LLM
+SCALAR_MAX_COLUMNS = 3
+TOP_VALUES = 5  # Most frequent values listed per text column in the aggregates
+
+# Numeric members that name something rather than measure it; shown exactly as Cube.js returns them
+IDENTIFIER_WORDS = {"id", "year", "code", "zip", "zipcode", "postcode", "postal", "phone", "sku", "ean", "upc", "number"}
+
+
+def count_tokens(text: str) -> int:
+    """
+    Tokens in `text` for the OpenAI models. Never blocks on loading the tokenizer: until it is
+    loaded (at startup, or in the background on first use) about four characters count as a token.
+    """
+    tokenizer = resources.tokenizer_nowait()
+    if tokenizer is None:
+        return len(text) // 4 + 1
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def is_identifier(column: str) -> bool:
+    """Whether a member like "orders_view.orderYear" or "users_view.user_id" holds an identifier, year or code."""
+    words = re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", column.split(".", 1)[-1]).replace("_", " ").replace(".", " ").lower().split()
+    return bool(words) and words[-1] in IDENTIFIER_WORDS
+
+
+def _format_number(value) -> str:
+    """Thousands separators for large numbers; small fractions keep their significant digits."""
+    if isinstance(value, int) or value.is_integer():
+        return f"{int(value):,}"
+    if abs(value) >= 100:
+        return f"{value:,.2f}"
+    return f"{value:.4g}"
+
+
+def _format_value(column: str, value) -> Optional[str]:
+    """Display text of a numeric value, or None if it is not a number."""
+    number = parse_number(value)
+    if number is None:
+        return None
+    return str(value) if is_identifier(column) else _format_number(number)
+
+
+def _member_titles(cubejs_data: dict) -> Dict[str, dict]:
+    annotation = cubejs_data.get("annotation") or {}
+    titles = {}
+    for kind in ("measures", "dimensions", "timeDimensions"):
+        titles.update(annotation.get(kind) or {})
+    return titles
+
+
+def column_aliases(columns: List[str], cubejs_data: Optional[dict] = None) -> Dict[str, str]:
+    """Short, unique column names: the annotation's short title, else the member name without its view."""
+    titles = _member_titles(cubejs_data or {})
+    candidates = {}
+    for column in columns:
+        meta = titles.get(column) or {}
+        candidates[column] = meta.get("shortTitle") or column.split(".", 1)[-1]
+    counts = Counter(candidates.values())
+    return {column: alias if counts[alias] == 1 else column for column, alias in candidates.items()}
+
+
+def _humanize(column: str, cubejs_data: dict) -> str:
+    meta = _member_titles(cubejs_data).get(column) or {}
+    if meta.get("title"):
+        return meta["title"]
+    # Without an annotation: "products_view.averagePrice" -> "Products average price"
+    view, _, member = column.partition(".")
+    name = f"{re.sub(r'_view$', '', view)} {member}".replace(".", " ").replace("_", " ")
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", name).strip().capitalize()
+
+
+def template_scalar_answer(cubejs_data: dict) -> Optional[str]:
+    """
+    Answer for a result of one row of at most SCALAR_MAX_COLUMNS numbers, e.g. a count or an
+    average, which needs no LLM. Returns None for any other result.
+    """
+    rows = cubejs_data.get("data") if isinstance(cubejs_data, dict) else None
+    if not FORMAT_TEMPLATE_SCALARS or not rows or len(rows) != 1 or not 0 < len(rows[0]) <= SCALAR_MAX_COLUMNS:
+        return None
+    formatted = {column: _format_value(column, value) for column, value in rows[0].items()}
+    if any(text is None for text in formatted.values()):
+        return None
+    parts = [f"{_humanize(column, cubejs_data)}: {text}" for column, text in formatted.items()]
+    return "; ".join(parts) + "."
+
+
+def _csv(rows: List[dict], columns: List[str], aliases: Dict[str, str]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow([aliases[column] for column in columns])
+    for row in rows:
+        writer.writerow(["" if row.get(column) is None else row.get(column) for column in columns])
+    return buffer.getvalue()
+
+
+def _aggregates(rows: List[dict], columns: List[str], aliases: Dict[str, str]) -> str:
+    lines = []
+    for column in columns:
+        values = [row.get(column) for row in rows if row.get(column) is not None]
+        numbers = [parse_number(value) for value in values]
+        if values and not is_identifier(column) and all(number is not None for number in numbers):
+            lines.append(f"{aliases[column]}: sum={_format_number(sum(numbers))}, min={_format_number(min(numbers))}, "
+                         f"max={_format_number(max(numbers))}, mean={_format_number(sum(numbers) / len(numbers))}")
+        else:
+            counts = Counter(str(value) for value in values)
+            top = ", ".join(f"{value} ({count})" for value, count in counts.most_common(TOP_VALUES))
+            lines.append(f"{aliases[column]}: {len(counts)} distinct; most frequent: {top}")
+    return "\n".join(lines)
+
+
+def render_rows(cubejs_data: dict, token_budget: int = FORMAT_TOKEN_BUDGET) -> str:
+    """
+    Result rows as CSV with short column names, kept within `token_budget` tokens. A result that
+    does not fit is sent as totals per column over all rows plus as many leading rows as fit.
+    """
+    rows = cubejs_data.get("data") if isinstance(cubejs_data, dict) else None
+    if not rows:
+        return "No data available"
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    aliases = column_aliases(columns, cubejs_data)
+    note = "Result truncated; more rows exist than were loaded.\n" if cubejs_data.get("truncated") else ""
+
+    table = note + _csv(rows, columns, aliases)
+    # Tokens average well under 8 characters, so longer text is over budget without counting
+    if len(table) <= token_budget * 8 and count_tokens(table) <= token_budget:
+        return table
+
+    aggregates = f"{note}{len(rows)} rows. Totals per column over all rows:\n{_aggregates(rows, columns, aliases)}\n"
+    remaining = token_budget - count_tokens(aggregates)
+    sample_size = len(rows)
+    while sample_size > 0:
+        sample_size //= 2
+        sample = _csv(rows[:sample_size], columns, aliases)
+        if count_tokens(sample) <= remaining:
+            break
+    logger.info(f"Result of {len(rows)} rows exceeds {token_budget} tokens; sending totals and {sample_size} sample rows.")
+    if not sample_size:
+        return aggregates
+    return f"{aggregates}\nFirst {sample_size} of {len(rows)} rows:\n{sample}"
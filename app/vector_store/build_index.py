@@ -0,0 +1,110 @@
+"""
+Offline build of the query-history vector index.
+
+Builds an index of the requested type from the vectors already in the store, reports its
+recall@k and per-query search latency against an exact flat index, and writes it as the new
+snapshot. Run it while the API is stopped:
+
+    python -m app.vector_store.build_index --type hnsw
+    python -m app.vector_store.build_index --type ivfpq --k 15 --dry-run
+    python -m app.vector_store.build_index --compare
+"""
+import argparse
+import time
+import numpy as np
+from app.utils.logger import logger
+from app.vector_store import store_manager
+from app.vector_store.index_factory import INDEX_TYPES, VECTOR_INDEX_TYPE, create_index, describe_index, index_size_bytes
+
+
+def _search_latencies(index, queries: np.ndarray, k: int):
+    """Searches one query at a time, as the API does, and returns (ids, latencies in ms)."""
+    ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, found = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append(found[0])
+    return np.array(ids), np.array(latencies)
+
+
+def evaluate_index(index_type: str, vector_ids: np.ndarray, vectors: np.ndarray, k: int, n_queries: int, seed: int = 0) -> dict:
+    """
+    Holds out `n_queries` stored vectors as queries, builds both an exact flat index and the
+    candidate index on the rest, and compares their top-k results.
+    """
+    rng = np.random.default_rng(seed)
+    n_queries = min(n_queries, max(1, len(vectors) // 10))
+    held_out = rng.choice(len(vectors), size=n_queries, replace=False)
+    mask = np.ones(len(vectors), dtype=bool)
+    mask[held_out] = False
+    base_ids, base_vectors, queries = vector_ids[mask], vectors[mask], vectors[held_out]
+
+    exact = create_index(vectors.shape[1], "flat")
+    exact.add_with_ids(base_vectors, base_ids)
+    build_start = time.perf_counter()
+    candidate = create_index(vectors.shape[1], index_type, training_vectors=base_vectors)
+    candidate.add_with_ids(base_vectors, base_ids)
+    build_seconds = time.perf_counter() - build_start
+
+    exact_bytes, candidate_bytes = index_size_bytes(exact), index_size_bytes(candidate)
+    truth, exact_latency = _search_latencies(exact, queries, k)
+    found, candidate_latency = _search_latencies(candidate, queries, k)
+    recall = np.mean([len(set(t[t >= 0]) & set(f[f >= 0])) / max(1, (t >= 0).sum()) for t, f in zip(truth, found)])
+
+    return {
+        "index": describe_index(candidate),
+        "vectors": int(len(base_vectors)),
+        "queries": int(n_queries),
+        f"recall@{k}": round(float(recall), 4),
+        "build_seconds": round(build_seconds, 3),
+        "flat_mb": round(exact_bytes / 2**20, 2),
+        "index_mb": round(candidate_bytes / 2**20, 2),
+        "compression": round(exact_bytes / max(1, candidate_bytes), 2),
+        "flat_ms_mean": round(float(exact_latency.mean()), 4),
+        "flat_ms_p95": round(float(np.percentile(exact_latency, 95)), 4),
+        "index_ms_mean": round(float(candidate_latency.mean()), 4),
+        "index_ms_p95": round(float(np.percentile(candidate_latency, 95)), 4),
+    }
+
+
+def build_index(index_type: str, vector_ids: np.ndarray, vectors: np.ndarray):
+    index = create_index(vectors.shape[1], index_type, training_vectors=vectors)
+    if len(vectors):
+        index.add_with_ids(vectors, vector_ids)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and evaluate the query-history vector index.")
+    parser.add_argument("--type", choices=INDEX_TYPES, default=VECTOR_INDEX_TYPE)
+    parser.add_argument("--k", type=int, default=15, help="Neighbours compared for recall")
+    parser.add_argument("--queries", type=int, default=200, help="Stored vectors held out as evaluation queries")
+    parser.add_argument("--dry-run", action="store_true", help="Report recall and latency without writing the index")
+    parser.add_argument("--compare", action="store_true", help="Evaluate every index type side by side; writes nothing")
+    args = parser.parse_args()
+
+    vector_ids, vectors = store_manager.stored_vectors()
+    if len(vectors) < 2:
+        logger.error("Not enough stored vectors to build and evaluate an index.")
+        return
+
+    if args.compare:
+        reports = [evaluate_index(index_type, vector_ids, vectors, args.k, args.queries) for index_type in INDEX_TYPES]
+        columns = list(reports[0].keys())
+        print("  ".join(f"{column:>16}" for column in columns))
+        for report in reports:
+            print("  ".join(f"{str(report[column]):>16}" for column in columns))
+        return
+
+    report = evaluate_index(args.type, vector_ids, vectors, args.k, args.queries)
+    for key, value in report.items():
+        print(f"{key:>16}: {value}")
+
+    if not args.dry_run:
+        store_manager.replace_index(build_index(args.type, vector_ids, vectors))
+        logger.info(f"Wrote {args.type} index with {len(vectors)} vectors to {store_manager.FAISS_INDEX_FILE}.")
+
+
+if __name__ == "__main__":
+    main()
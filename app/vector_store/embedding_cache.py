@@ -0,0 +1,107 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+import numpy as np
+from app.utils.logger import logger
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_FILE = os.getenv("EMBEDDING_CACHE_FILE")  # Optional .npz file to persist the cache across restarts
+
+
+def normalize_text(text: str) -> str:
+    """Cache key for a piece of text: case-folded with whitespace collapsed."""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU cache of embedding vectors keyed by normalized text.
+    """
+
+    def __init__(self, max_size: int = EMBEDDING_CACHE_SIZE, cache_file: Optional[str] = EMBEDDING_CACHE_FILE):
+        self.max_size = max_size
+        self.cache_file = cache_file
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load_pending = bool(cache_file)  # The cache file is read on first use, not at import
+
+    def _ensure_loaded(self):
+        if self._load_pending:
+            self._load_pending = False
+            if os.path.exists(self.cache_file):
+                self.load(self.cache_file)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        self._ensure_loaded()
+        key = normalize_text(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, text: str, vector) -> np.ndarray:
+        self._ensure_loaded()
+        vector = np.asarray(vector, dtype="float32")
+        key = normalize_text(text)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return vector
+
+    def get_or_compute(self, text: str, compute: Callable[[str], list]) -> np.ndarray:
+        vector = self.get(text)
+        if vector is None:
+            vector = self.put(text, compute(text))
+        return vector
+
+    async def aget_or_compute(self, text: str, compute: Callable[[str], Awaitable[list]]) -> np.ndarray:
+        vector = self.get(text)
+        if vector is None:
+            vector = self.put(text, await compute(text))
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+    def load(self, path: str):
+        try:
+            with np.load(path) as archive:
+                keys, vectors = archive["keys"], archive["vectors"]
+            with self._lock:
+                for key, vector in zip(keys.tolist(), vectors):
+                    self._entries[key] = vector
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            logger.info(f"Loaded {len(keys)} cached embeddings from {path}.")
+        except Exception as e:
+            logger.error(f"Error loading embedding cache from {path}: {str(e)}")
+
+    def save(self, path: Optional[str] = None):
+        """Persist the cache to disk with an atomic rename. No-op when no cache file is configured."""
+        path = path or self.cache_file
+        if not path:
+            return
+        with self._lock:
+            keys = list(self._entries.keys())
+            vectors = list(self._entries.values())
+        if not keys:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=np.array(keys), vectors=np.stack(vectors))
+        os.replace(tmp_path, path)
+        logger.info(f"Saved {len(keys)} cached embeddings to {path}.")
+
+
+embedding_cache = EmbeddingCache()
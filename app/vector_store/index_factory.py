@@ -0,0 +1,121 @@
+import os
+import math
+import faiss
+import numpy as np
+from typing import Optional
+from app.utils.logger import logger
+
+# Index type for the query history: "flat" (exact), "hnsw" or "ivfpq" (approximate), or a compressed
+# flat index: "fp16" / "int8" (scalar quantization, 2x / 4x smaller) or "pq" (product quantization)
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat").lower()
+HNSW_M = int(os.getenv("VECTOR_INDEX_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_INDEX_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("VECTOR_INDEX_HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("VECTOR_INDEX_IVF_NLIST", "0"))  # 0 sizes nlist from the training set
+IVF_NPROBE = int(os.getenv("VECTOR_INDEX_IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("VECTOR_INDEX_PQ_M", "48"))  # Sub-quantizers; must divide the vector dimension
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq", "fp16", "int8", "pq")
+SCALAR_QUANTIZERS = {"fp16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+MIN_POINTS_PER_CENTROID = 39  # FAISS warns below this many training points per centroid
+
+
+def requires_training(index_type: str) -> bool:
+    return index_type in ("ivfpq", "int8", "pq")
+
+
+def _pq_nbits(n_train: int) -> int:
+    """PQ code size the training set can support; 8 bits needs 256 centroids per sub-quantizer."""
+    return max(1, min(8, int(math.log2(max(2, n_train // MIN_POINTS_PER_CENTROID)))))
+
+
+def _ivfpq_sizes(n_train: int) -> tuple:
+    """Picks nlist and PQ bits that the training set can support."""
+    nlist = IVF_NLIST or int(4 * math.sqrt(n_train))
+    nlist = max(1, min(nlist, n_train // MIN_POINTS_PER_CENTROID))
+    return nlist, _pq_nbits(n_train)
+
+
+def create_index(dim: int, index_type: str = VECTOR_INDEX_TYPE, training_vectors: Optional[np.ndarray] = None):
+    """
+    Creates an empty ID-mapped FAISS index of the requested type. IVF-PQ, int8 and PQ are trained
+    on `training_vectors`; without enough of them they fall back to a flat index.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type '{index_type}', expected one of {INDEX_TYPES}")
+
+    if index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, HNSW_M)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type == "ivfpq":
+        n_train = 0 if training_vectors is None else len(training_vectors)
+        if n_train < MIN_POINTS_PER_CENTROID * 2 or dim % PQ_M:
+            logger.warning(f"Cannot train IVF-PQ on {n_train} vectors (dim {dim}, m {PQ_M}); using a flat index.")
+            return create_index(dim, "flat")
+        nlist, nbits = _ivfpq_sizes(n_train)
+        base = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, PQ_M, nbits)
+        base.train(np.ascontiguousarray(training_vectors, dtype="float32"))
+    elif index_type in SCALAR_QUANTIZERS:
+        base = faiss.IndexScalarQuantizer(dim, SCALAR_QUANTIZERS[index_type], faiss.METRIC_L2)
+        if not base.is_trained:
+            # int8 learns per-dimension value ranges from the stored vectors
+            if training_vectors is None or not len(training_vectors):
+                logger.warning(f"Cannot train {index_type} without stored vectors; using a flat index.")
+                return create_index(dim, "flat")
+            base.train(np.ascontiguousarray(training_vectors, dtype="float32"))
+    elif index_type == "pq":
+        n_train = 0 if training_vectors is None else len(training_vectors)
+        if n_train < MIN_POINTS_PER_CENTROID * 2 or dim % PQ_M:
+            logger.warning(f"Cannot train PQ on {n_train} vectors (dim {dim}, m {PQ_M}); using a flat index.")
+            return create_index(dim, "flat")
+        base = faiss.IndexPQ(dim, PQ_M, _pq_nbits(n_train))
+        base.train(np.ascontiguousarray(training_vectors, dtype="float32"))
+    else:
+        base = faiss.IndexFlatL2(dim)
+
+    index = faiss.IndexIDMap2(base)
+    configure_search(index)
+    return index
+
+
+def configure_search(index):
+    """Applies the configured search-time parameters (efSearch, nprobe) to a loaded index."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(base, faiss.IndexIVF):
+        base.nprobe = IVF_NPROBE
+    return index
+
+
+def index_type_of(index) -> str:
+    """The INDEX_TYPES name of an ID-mapped index, so it can be rebuilt as the same type."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return {v: k for k, v in SCALAR_QUANTIZERS.items()}.get(base.sq.qtype, "flat")
+    if isinstance(base, faiss.IndexPQ):
+        return "pq"
+    return "flat"
+
+
+def describe_index(index) -> str:
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        qtype = {v: k for k, v in SCALAR_QUANTIZERS.items()}.get(base.sq.qtype, base.sq.qtype)
+        return f"{type(base).__name__}({qtype})"
+    return type(base).__name__
+
+
+def highest_id(index) -> int:
+    """Largest vector ID in an ID-mapped index, or -1 if it is empty. Reads the ID array in place, without copying it."""
+    n = index.id_map.size()
+    return int(faiss.rev_swig_ptr(index.id_map.data(), n).max()) if n else -1
+
+
+def index_size_bytes(index) -> int:
+    """Serialized size of an index, a close measure of the memory it holds."""
+    return int(faiss.serialize_index(index).size)
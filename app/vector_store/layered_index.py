@@ -0,0 +1,86 @@
+import faiss
+import numpy as np
+from app.vector_store.index_factory import create_index, describe_index, highest_id, index_type_of
+
+
+class LayeredIndex:
+    """
+    A read-only base index memory-mapped from the snapshot file, plus an in-memory delta index
+    holding vectors added since. Processes mapping the same snapshot share its pages, and opening
+    it takes constant time whatever its size.
+
+    Exposes the subset of the FAISS index API the store uses. Vectors cannot be removed from the
+    base; remove_ids raises RuntimeError for them, like index types without removal support.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.base = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        self.mapped = True
+        self.delta = create_index(dim, "flat")
+        self.d = dim
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + self.delta.ntotal
+
+    @property
+    def id_map(self):
+        ids = np.concatenate([faiss.vector_to_array(self.base.id_map), faiss.vector_to_array(self.delta.id_map)])
+        vector = faiss.Int64Vector()
+        faiss.copy_array_to_vector(ids.astype("int64"), vector)
+        return vector
+
+    def highest_id(self) -> int:
+        return max(highest_id(self.base), highest_id(self.delta))
+
+    def add_with_ids(self, vectors: np.ndarray, ids: np.ndarray):
+        self.delta.add_with_ids(vectors, ids)
+
+    def search(self, queries: np.ndarray, k: int):
+        D, I = self.base.search(queries, k)
+        if not self.delta.ntotal:
+            return D, I
+        delta_D, delta_I = self.delta.search(queries, k)
+        D, I = np.hstack([D, delta_D]), np.hstack([I, delta_I])
+        # Unfilled slots (-1) sort last; all store indexes use L2 distance, smaller is nearer
+        D = np.where(I < 0, np.inf, D)
+        order = np.argsort(D, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+    def remove_ids(self, ids: np.ndarray) -> int:
+        removed = self.delta.remove_ids(ids)
+        if removed < len(ids):
+            raise RuntimeError("Vectors in the memory-mapped base index cannot be removed")
+        return removed
+
+    def reconstruct(self, vector_id: int) -> np.ndarray:
+        if vector_id in set(faiss.vector_to_array(self.delta.id_map).tolist()):
+            return self.delta.reconstruct(vector_id)
+        return self.base.reconstruct(vector_id)
+
+    def index_type(self) -> str:
+        return index_type_of(self.base)
+
+    def reset(self):
+        # An owned copy of the snapshot keeps its index type and any training
+        self.base = faiss.read_index(self.path)
+        self.base.reset()
+        self.mapped = False
+        self.delta.reset()
+
+    def to_index(self):
+        """Copies base and delta into one in-memory index, for writing a new snapshot."""
+        # A mapped base only views the file; read an owned copy to add to
+        merged = faiss.read_index(self.path) if self.mapped else faiss.clone_index(self.base)
+        if self.delta.ntotal:
+            ids = faiss.vector_to_array(self.delta.id_map)
+            # Another process may already have written some of these into the snapshot
+            new = ~np.isin(ids, faiss.vector_to_array(merged.id_map))
+            if new.any():
+                merged.add_with_ids(self.delta.index.reconstruct_n(0, self.delta.ntotal)[new], ids[new])
+        return merged
+
+    def describe(self) -> str:
+        mapped = " (memory-mapped)" if self.mapped else ""
+        return f"{describe_index(self.base)}{mapped} + {self.delta.ntotal} in memory"
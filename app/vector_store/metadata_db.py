@@ -0,0 +1,351 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from app.utils.logger import logger
+
+METADATA_DB_FILE = os.getenv("METADATA_DB_FILE", "metadata.db")
+METADATA_DB_MMAP_SIZE = int(os.getenv("METADATA_DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # Bytes of the database read through mmap
+
+# Large serialized blobs kept out of the main table and only read when a caller asks for them
+PAYLOAD_FIELDS = ("data", "similar_queries_info", "cubejs_query")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    query_id TEXT PRIMARY KEY,
+    vector_id INTEGER UNIQUE,
+    request_id TEXT,
+    query TEXT NOT NULL,
+    status TEXT,
+    timestamp TEXT,
+    record TEXT NOT NULL,
+    vector BLOB
+);
+CREATE TABLE IF NOT EXISTS payloads (
+    query_id TEXT PRIMARY KEY REFERENCES queries(query_id) ON DELETE CASCADE,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value
+);
+CREATE INDEX IF NOT EXISTS idx_queries_request_id ON queries(request_id);
+CREATE INDEX IF NOT EXISTS idx_queries_status ON queries(status);
+CREATE INDEX IF NOT EXISTS idx_queries_timestamp ON queries(timestamp);
+"""
+
+
+def _file_timestamp(path: str) -> str:
+    # Same format as the stored timestamps, str(datetime.utcnow())
+    return str(datetime.utcfromtimestamp(os.path.getmtime(path)))
+
+
+def _vector_to_blob(vector: Optional[np.ndarray]) -> Optional[bytes]:
+    return None if vector is None else np.asarray(vector, dtype="float32").tobytes()
+
+
+class StoredRecord(Mapping):
+    """
+    Read-only view of a stored record. Core fields are loaded eagerly; the large payload
+    fields are fetched from SQLite the first time one of them is accessed.
+    """
+
+    def __init__(self, db: "MetadataDB", query_id: str, core: Dict[str, Any], has_payload: bool):
+        self._db = db
+        self.query_id = query_id
+        self._core = core
+        self._payload = None if has_payload else {}
+
+    def _load_payload(self) -> Dict[str, Any]:
+        if self._payload is None:
+            self._payload = self._db.get_payload(self.query_id)
+        return self._payload
+
+    def __getitem__(self, key):
+        if key in self._core:
+            return self._core[key]
+        if key in PAYLOAD_FIELDS:
+            return self._load_payload()[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from self._core
+        yield from self._load_payload()
+
+    def __len__(self):
+        return len(self._core) + len(self._load_payload())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self._core, **self._load_payload()}
+
+    def __repr__(self):
+        return f"StoredRecord({self.query_id!r}, query={self._core.get('query')!r})"
+
+
+class MetadataDB:
+    """
+    Metadata store for the vector store on an embedded SQLite database, keyed by query ID
+    and indexed on vector_id, request_id, status and timestamp.
+    """
+
+    def __init__(self, path: str = METADATA_DB_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Reads go through the shared page cache instead of per-process copies
+        self._conn.execute(f"PRAGMA mmap_size={METADATA_DB_MMAP_SIZE}")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(queries)")]
+        if "vector" not in columns:
+            self._conn.execute("ALTER TABLE queries ADD COLUMN vector BLOB")
+
+    def _row_to_record(self, row) -> StoredRecord:
+        query_id, vector_id, record_json, has_payload = row
+        core = json.loads(record_json)
+        core["vector_id"] = vector_id
+        return StoredRecord(self, query_id, core, bool(has_payload))
+
+    def _select(self, where: str, params=()) -> List[StoredRecord]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT q.query_id, q.vector_id, q.record, p.query_id IS NOT NULL FROM queries q "
+                f"LEFT JOIN payloads p ON p.query_id = q.query_id WHERE {where}",
+                params,
+            ).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _insert(self, query_id: str, record: Dict[str, Any], vector: Optional[np.ndarray] = None):
+        core = {k: v for k, v in record.items() if k not in PAYLOAD_FIELDS and k != "vector_id"}
+        payload = {k: v for k, v in record.items() if k in PAYLOAD_FIELDS}
+        self._conn.execute(
+            "INSERT OR REPLACE INTO queries (query_id, vector_id, request_id, query, status, timestamp, record, vector) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (query_id, record.get("vector_id"), record.get("request_id"), record.get("query", ""),
+             record.get("status"), record.get("timestamp"), json.dumps(core), _vector_to_blob(vector)),
+        )
+        if payload:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO payloads (query_id, payload) VALUES (?, ?)",
+                (query_id, json.dumps(payload)),
+            )
+
+    def put(self, query_id: str, record: Dict[str, Any], vector: Optional[np.ndarray] = None):
+        """Inserts or replaces a record and its vector, splitting the payload fields into their own table."""
+        with self._transaction():
+            self._insert(query_id, record, vector)
+
+    def put_many(self, records: List[tuple]):
+        """Inserts (query_id, record, vector) tuples in a single transaction."""
+        with self._transaction():
+            for query_id, record, vector in records:
+                self._insert(query_id, record, vector)
+
+    def get(self, query_id: str) -> Optional[StoredRecord]:
+        records = self._select("q.query_id = ?", (query_id,))
+        return records[0] if records else None
+
+    def get_by_request_id(self, request_id: str) -> List[StoredRecord]:
+        return self._select("q.request_id = ?", (request_id,))
+
+    def update_by_request_id(self, request_id: str, updates: Dict[str, Any]) -> int:
+        """Merges `updates` into the core fields of every record with this request ID. Returns the number updated."""
+        with self._transaction():
+            rows = self._conn.execute(
+                "SELECT query_id, record FROM queries WHERE request_id = ?", (request_id,)
+            ).fetchall()
+            for query_id, record_json in rows:
+                core = {**json.loads(record_json), **updates}
+                self._conn.execute(
+                    "UPDATE queries SET record = ?, status = ?, timestamp = ? WHERE query_id = ?",
+                    (json.dumps(core), core.get("status"), core.get("timestamp"), query_id),
+                )
+        return len(rows)
+
+    def get_payload(self, query_id: str) -> Dict[str, Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM payloads WHERE query_id = ?", (query_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def get_by_vector_ids(self, vector_ids: List[int]) -> List[StoredRecord]:
+        """Returns records for the given FAISS vector IDs, in the same order. Unknown IDs are skipped."""
+        vector_ids = [int(v) for v in vector_ids if v >= 0]
+        if not vector_ids:
+            return []
+        placeholders = ",".join("?" * len(vector_ids))
+        by_vector_id = {r["vector_id"]: r for r in self._select(f"q.vector_id IN ({placeholders})", vector_ids)}
+        return [by_vector_id[v] for v in vector_ids if v in by_vector_id]
+
+    def delete(self, query_id: str) -> Optional[int]:
+        """Deletes a record and returns its vector ID, or None if it did not exist."""
+        with self._lock:
+            row = self._conn.execute("SELECT vector_id FROM queries WHERE query_id = ?", (query_id,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("DELETE FROM queries WHERE query_id = ?", (query_id,))
+        return row[0]
+
+    def delete_by_request_id(self, request_id: str) -> List[int]:
+        """Deletes every record with this request ID, e.g. a draft and its final answer, and returns their vector IDs."""
+        with self._transaction():
+            vector_ids = [row[0] for row in self._conn.execute(
+                "SELECT vector_id FROM queries WHERE request_id = ? AND vector_id IS NOT NULL", (request_id,)
+            )]
+            self._conn.execute("DELETE FROM queries WHERE request_id = ?", (request_id,))
+        return vector_ids
+
+    def delete_many(self, query_ids: List[str]):
+        """Deletes the records with these query IDs in one transaction."""
+        with self._transaction():
+            self._conn.executemany("DELETE FROM queries WHERE query_id = ?", [(query_id,) for query_id in query_ids])
+
+    def delete_before(self, timestamp: str) -> List[int]:
+        """
+        Deletes every record older than `timestamp` and returns their vector IDs. Records without a
+        timestamp never match; new records are stamped when stored, and migration gives legacy records
+        the legacy file's modification time.
+        """
+        with self._transaction():
+            vector_ids = [row[0] for row in self._conn.execute(
+                "SELECT vector_id FROM queries WHERE timestamp < ? AND vector_id IS NOT NULL", (timestamp,)
+            )]
+            self._conn.execute("DELETE FROM queries WHERE timestamp < ?", (timestamp,))
+        return vector_ids
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM payloads")
+            self._conn.execute("DELETE FROM queries")
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+
+    def max_vector_id(self) -> int:
+        with self._lock:
+            value = self._conn.execute("SELECT MAX(vector_id) FROM queries").fetchone()[0]
+        return -1 if value is None else value
+
+    def reserve_vector_ids(self, count: int, floor: int = 0) -> int:
+        """
+        Reserves `count` new vector IDs and returns the first. IDs come from a stored counter that only
+        goes up, so the IDs of deleted records, which the index may still hold, are never handed out again.
+        The counter starts at `floor` or above it.
+        """
+        with self._transaction():
+            row = self._conn.execute("SELECT value FROM settings WHERE name = 'next_vector_id'").fetchone()
+            first = max(floor, row[0] if row else 0)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO settings (name, value) VALUES ('next_vector_id', ?)", (first + count,)
+            )
+        return first
+
+    def iter_vectors(self) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yields (vector_id, vector) for every record with a stored vector, in vector ID order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT vector_id, vector FROM queries WHERE vector IS NOT NULL ORDER BY vector_id"
+            ).fetchall()
+        for vector_id, blob in rows:
+            yield vector_id, np.frombuffer(blob, dtype="float32")
+
+    def vectors_after(self, vector_id: int) -> Dict[int, np.ndarray]:
+        """Stored vectors with an ID above `vector_id`, in vector ID order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT vector_id, vector FROM queries WHERE vector_id > ? AND vector IS NOT NULL ORDER BY vector_id",
+                (vector_id,),
+            ).fetchall()
+        return {vector_id: np.frombuffer(blob, dtype="float32") for vector_id, blob in rows}
+
+    def vector_ids_missing_vectors(self) -> List[int]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT vector_id FROM queries WHERE vector IS NULL AND vector_id IS NOT NULL"
+            )]
+
+    def set_vectors(self, vectors: Dict[int, np.ndarray]):
+        with self._transaction():
+            self._conn.executemany(
+                "UPDATE queries SET vector = ? WHERE vector_id = ?",
+                [(_vector_to_blob(vector), vector_id) for vector_id, vector in vectors.items()],
+            )
+
+    def _setting(self, name: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, name: str, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)", (name, value))
+
+    def migrate_from_json(self, json_path: str):
+        """
+        One-shot import of a legacy metadata.json. Files written before vector IDs existed get each
+        record's position in the file, which is how legacy FAISS rows were aligned. The JSON file is renamed afterwards
+        so the import never runs twice. Records without a timestamp get the file's modification time, so
+        pruning by age reaches them; databases migrated before that are filled in once from the renamed file.
+        """
+        if self.count():
+            self._fill_legacy_timestamps(f"{json_path}.migrated")
+            return
+        if not os.path.exists(json_path):
+            return
+        with open(json_path, "r") as f:
+            legacy_store = json.load(f)
+        legacy_timestamp = _file_timestamp(json_path)
+        positional = not any("vector_id" in record for record in legacy_store.values())
+        with self._transaction():
+            for position, (query_id, record) in enumerate(legacy_store.items()):
+                vector_id = position if positional else record.get("vector_id")
+                self._insert(query_id, {**record, "vector_id": vector_id, "timestamp": record.get("timestamp") or legacy_timestamp})
+        self._set_setting("legacy_timestamps_filled", 1)
+        os.replace(json_path, f"{json_path}.migrated")
+        logger.info(f"Migrated {len(legacy_store)} records from {json_path} to {self.path}.")
+
+    def _fill_legacy_timestamps(self, migrated_path: str) -> int:
+        """
+        Gives records imported from `migrated_path` without a timestamp the file's modification time, in the
+        column and the stored record. Only those records are touched, and only once. Returns the number updated.
+        """
+        if self._setting("legacy_timestamps_filled") or not os.path.exists(migrated_path):
+            return 0
+        with open(migrated_path, "r") as f:
+            query_ids = list(json.load(f))
+        timestamp = _file_timestamp(migrated_path)
+        updated = 0
+        with self._transaction():
+            for start in range(0, len(query_ids), 500):
+                chunk = query_ids[start:start + 500]
+                updated += self._conn.execute(
+                    "UPDATE queries SET timestamp = ?, record = json_set(record, '$.timestamp', ?) "
+                    f"WHERE timestamp IS NULL AND query_id IN ({','.join('?' * len(chunk))})",
+                    (timestamp, timestamp, *chunk),
+                ).rowcount
+            self._set_setting("legacy_timestamps_filled", 1)
+        if updated:
+            logger.info(f"Set timestamp {timestamp} on {updated} legacy records without one.")
+        return updated
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,89 @@
+import base64
+import json
+import os
+import re
+import zlib
+from typing import Any, Dict, List, Optional
+
+HISTORY_MAX_ROWS = int(os.getenv("HISTORY_MAX_ROWS", "1000"))  # Result rows kept with each history record
+HISTORY_COMPRESSION = os.getenv("HISTORY_COMPRESSION", "zlib").lower()  # "zlib" or "none"
+HISTORY_COMPRESS_MIN_BYTES = int(os.getenv("HISTORY_COMPRESS_MIN_BYTES", "1024"))  # Smaller results stay readable
+
+COLUMNAR_FORMAT = "columnar"
+
+# Cube.js returns numbers as strings; only plain decimals are parsed so codes like "007" stay strings
+_NUMBER = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?")
+
+
+def _parse_number(value: str):
+    return int(value) if value.lstrip("-").isdigit() else float(value)
+
+
+def _is_number(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return True
+    return isinstance(value, str) and _NUMBER.fullmatch(value) is not None
+
+
+def parse_number(value):
+    """The number a Cube.js value holds, or None if it is not numeric (including codes like "007")."""
+    if not _is_number(value):
+        return None
+    return _parse_number(value) if isinstance(value, str) else value
+
+
+def encode_rows(rows: Optional[List[dict]], max_rows: int = HISTORY_MAX_ROWS, truncated: bool = False,
+                compression: str = HISTORY_COMPRESSION) -> Optional[Dict[str, Any]]:
+    """
+    Column-wise form of Cube.js result rows for the history: member names are stored once, numeric
+    columns are parsed to numbers, at most `max_rows` rows are kept, and large results are zlib
+    compressed. `row_count` is the size of the full result; `truncated` marks that rows were dropped
+    here or by the loader.
+    """
+    if not rows or not isinstance(rows, list):
+        return None
+    kept = rows[:max_rows]
+    columns = list(dict.fromkeys(key for row in kept for key in row))
+    values, types = [], []
+    for column in columns:
+        column_values = [row.get(column) for row in kept]
+        if all(value is None or _is_number(value) for value in column_values):
+            column_values = [_parse_number(value) if isinstance(value, str) else value for value in column_values]
+            types.append("number")
+        else:
+            types.append("raw")
+        values.append(column_values)
+
+    encoded = {
+        "format": COLUMNAR_FORMAT,
+        "row_count": len(rows),
+        "truncated": truncated or len(rows) > len(kept),
+    }
+    body = {"columns": columns, "types": types, "values": values}
+    raw = json.dumps(body, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if compression == "zlib" and len(raw) >= HISTORY_COMPRESS_MIN_BYTES:
+        encoded["compression"] = "zlib"
+        encoded["encoded"] = base64.b64encode(zlib.compress(raw, 6)).decode("ascii")
+    else:
+        encoded.update(body)
+    return encoded
+
+
+def decode_rows(stored) -> Optional[List[dict]]:
+    """Row dicts from a stored result: the columnar form, a legacy list of rows, or either serialized as JSON."""
+    if isinstance(stored, str):
+        try:
+            stored = json.loads(stored)
+        except json.JSONDecodeError:
+            return None
+    if isinstance(stored, list):
+        return stored
+    if not isinstance(stored, dict) or stored.get("format") != COLUMNAR_FORMAT:
+        return None
+    body = stored
+    if stored.get("compression") == "zlib":
+        body = json.loads(zlib.decompress(base64.b64decode(stored["encoded"])))
+    columns = body["columns"]
+    return [dict(zip(columns, row)) for row in zip(*body["values"])] if columns else []
@@ -1,123 +1,605 @@
 import os
 import json
 import uuid
+import base64
+import asyncio
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 import faiss
 import numpy as np
-from typing import List, Dict, Any
-from langchain.schema import Document
-from langchain_openai import OpenAIEmbeddings
+try:
+    import fcntl
+except ImportError:  # Windows; multi-process mode is unavailable there
+    fcntl = None
+from typing import List, Dict, Any, Optional
 from app.utils.logger import logger
+from app.utils.resources import resources
+from app.vector_store.embedding_cache import embedding_cache
+from app.vector_store.metadata_db import MetadataDB, METADATA_DB_FILE
+from app.vector_store.index_factory import VECTOR_INDEX_TYPE, create_index, configure_search, describe_index, highest_id, index_type_of
+from app.vector_store.layered_index import LayeredIndex
+from app.vector_store.write_queue import WriteBehindQueue
 
-# Initialize embeddings and FAISS index
-embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
 VECTOR_DIM = 1536  # OpenAI embeddings dimension (adjust if different)
 FAISS_INDEX_FILE = "faiss_index.index"
-METADATA_FILE = "metadata.json"
-
-# Initialize FAISS index and metadata storage
-if os.path.exists(FAISS_INDEX_FILE):
-    # Load existing index
-    index = faiss.read_index(FAISS_INDEX_FILE)
-else:
-    # Create a new FAISS index
-    index = faiss.IndexFlatL2(VECTOR_DIM)
-
-# Metadata dictionary to store document metadata
-if os.path.exists(METADATA_FILE):
-    with open(METADATA_FILE, "r") as f:
-        metadata_store = json.load(f)
-else:
-    metadata_store = {}
+METADATA_FILE = "metadata.json"  # Legacy metadata store, migrated into METADATA_DB_FILE
+WAL_FILE = "vector_store.wal"  # Append-only log of vectors added since the last snapshot
+WAL_COMPACT_EVERY = int(os.getenv("VECTOR_STORE_COMPACT_EVERY", "200"))  # Log entries between snapshots
+TOMBSTONE_RATIO = float(os.getenv("VECTOR_STORE_TOMBSTONE_RATIO", "0.2"))  # Deleted share of the index that triggers a rebuild
 
-def save_faiss_index():
-    """Saves the FAISS index and metadata to disk."""
-    faiss.write_index(index, FAISS_INDEX_FILE)
-    with open(METADATA_FILE, "w") as f:
-        json.dump(metadata_store, f)
+# Memory-map the snapshot read-only and keep only newer vectors in process memory
+VECTOR_INDEX_MMAP = os.getenv("VECTOR_INDEX_MMAP", "false").lower() in ("1", "true", "yes")
+VECTOR_STORE_THREADS = int(os.getenv("VECTOR_STORE_THREADS", "4"))  # Threads for FAISS/SQLite work off the event loop
+
+# Set when several processes (uvicorn --workers N) share the same store files
+VECTOR_STORE_MULTIPROCESS = os.getenv("VECTOR_STORE_MULTIPROCESS", "false").lower() in ("1", "true", "yes")
+LOCK_FILE = f"{WAL_FILE}.lock"  # Held by the single writer process of a multi-process store
+if VECTOR_STORE_MULTIPROCESS and fcntl is None:
+    raise RuntimeError("VECTOR_STORE_MULTIPROCESS requires fcntl file locks, which this platform does not provide")
+
+# Serializes index access within the process; FAISS does not allow searches concurrent with writes
+store_lock = threading.RLock()
+store_executor = ThreadPoolExecutor(max_workers=VECTOR_STORE_THREADS, thread_name_prefix="vector-store")
+_process_lock_depth = 0
+
+@contextmanager
+def _process_lock():
+    """
+    Exclusive lock across processes for writes in multi-process mode; a no-op otherwise.
+    Re-entrant, and always taken while holding store_lock.
+    """
+    global _process_lock_depth
+    if not VECTOR_STORE_MULTIPROCESS:
+        yield
+        return
+    with store_lock:
+        _process_lock_depth += 1
+        try:
+            if _process_lock_depth > 1:
+                yield
+                return
+            with open(LOCK_FILE, "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        finally:
+            _process_lock_depth -= 1
+
+# Record metadata lives in SQLite and vectors in the FAISS index; both are opened by init_vector_store()
+metadata_db = None
+index = None
+highest_indexed_id = -1  # Vector IDs only go up, so every logged ID at or below this one is already indexed
+tombstones = 0  # Deleted vectors still present in an index type that cannot remove them; skipped at search time
+wal_entries = 0
+wal_generation = 0  # Snapshot generation the loaded index and log offset belong to
+wal_offset = 0      # Bytes of the log already applied to the index
+_wal_seen = None    # (inode, size) of the log when it was last read
+_initialized = False
+_init_lock = threading.Lock()
+
+def init_vector_store():
+    """
+    Opens the metadata database and loads the index on first use, importing a legacy
+    metadata.json and replaying the log. Later calls return immediately.
+    """
+    global metadata_db, index, highest_indexed_id, tombstones, _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        with store_lock, _process_lock():
+            metadata_db = MetadataDB(METADATA_DB_FILE)
+            metadata_db.migrate_from_json(METADATA_FILE)
+            index = _load_index()
+            highest_indexed_id = _highest_indexed_id()
+            _replay_wal()
+            _backfill_stored_vectors()
+            _reindex_unlogged_records()
+            # Stores written before the ID counter existed start it above every ID in use
+            metadata_db.reserve_vector_ids(0, floor=max(metadata_db.max_vector_id(), highest_indexed_id) + 1)
+            tombstones = max(0, index.ntotal - metadata_db.count())
+        _initialized = True
+
+def _new_index(index_type: str = VECTOR_INDEX_TYPE, training_vectors: Optional[np.ndarray] = None):
+    """Creates an empty FAISS index with explicit int64 vector IDs, of the configured type (VECTOR_INDEX_TYPE) by default."""
+    return create_index(VECTOR_DIM, index_type, training_vectors=training_vectors)
+
+def _loaded_index_type() -> str:
+    return index.index_type() if isinstance(index, LayeredIndex) else index_type_of(index)
 
-def add_query_to_vector_store(query: str, response: str, metadata: Dict[str, Any]):
+def _load_index():
+    """
+    Loads the FAISS index from disk. Legacy indexes without explicit IDs were kept aligned
+    with metadata insertion order, which the metadata migration preserved as vector IDs 0..n-1.
+    """
+    if not os.path.exists(FAISS_INDEX_FILE):
+        return _new_index()
+
+    if VECTOR_INDEX_MMAP:
+        layered_index = LayeredIndex(FAISS_INDEX_FILE, VECTOR_DIM)
+        if isinstance(layered_index.base, faiss.IndexIDMap2):
+            configure_search(layered_index.base)
+            logger.info(f"Mapped {layered_index.describe()} vector index with {layered_index.ntotal} vectors.")
+            return layered_index
+
+    loaded_index = faiss.read_index(FAISS_INDEX_FILE)
+    if isinstance(loaded_index, faiss.IndexIDMap2):
+        logger.info(f"Loaded {describe_index(loaded_index)} vector index with {loaded_index.ntotal} vectors.")
+        return configure_search(loaded_index)
+
+    migrated_index = create_index(VECTOR_DIM, "flat")
+    n = loaded_index.ntotal
+    if n:
+        migrated_index.add_with_ids(loaded_index.reconstruct_n(0, n), np.arange(n, dtype="int64"))
+    logger.info(f"Migrated {n} vectors to an ID-mapped FAISS index.")
+    return migrated_index
+
+def _highest_indexed_id() -> int:
+    return index.highest_id() if isinstance(index, LayeredIndex) else highest_id(index)
+
+def _encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype="float32").tobytes()).decode("ascii")
+
+def _decode_vector(encoded: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(encoded), dtype="float32")
+
+def _wal_header(generation: int) -> bytes:
+    return (json.dumps({"generation": generation}) + "\n").encode("utf-8")
+
+def _replay_wal(reload: bool = False):
+    """
+    Applies log entries not yet in the index. The log starts with the generation of the snapshot it
+    extends; when it names a different generation than the one loaded, another process compacted the
+    store and, with `reload`, the snapshot is reloaded first. A torn final line is left for the next read.
+    """
+    global index, highest_indexed_id, wal_entries, wal_generation, wal_offset, tombstones, _wal_seen
     try:
-        query_embedding = embeddings.embed_query(query)
-        query_embedding = np.array(query_embedding).astype("float32")
+        f = open(WAL_FILE, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        inode = os.fstat(f.fileno()).st_ino
+        first_line = f.readline()
+        try:
+            header = json.loads(first_line) if first_line.endswith(b"\n") else {}
+        except json.JSONDecodeError:
+            header = {}
+        header_size = len(first_line) if "generation" in header else 0
+        generation = header.get("generation", 0)
+        if generation != wal_generation:
+            if reload:
+                index = _load_index()
+                highest_indexed_id = _highest_indexed_id()
+                tombstones = max(0, index.ntotal - metadata_db.count())
+                logger.info(f"Reloaded the vector index for store generation {generation}.")
+            wal_generation, wal_offset, wal_entries = generation, 0, 0
+        wal_offset = max(wal_offset, header_size)
+        f.seek(wal_offset)
 
-        # Generate a unique ID for the query
-        query_id = str(uuid.uuid4())
+        # Entries are logged in vector ID order; those at or below the highest indexed ID are
+        # already in the index, e.g. a snapshot written just before a crash replaced the log
+        vector_ids, vectors = [], []
+        for line in f:
+            if not line.endswith(b"\n"):
+                logger.warning("Ignoring incomplete entry at the end of the vector store log.")
+                break
+            entry = json.loads(line)
+            if entry["vector_id"] > highest_indexed_id:
+                vector_ids.append(entry["vector_id"])
+                vectors.append(_decode_vector(entry["vector"]))
+                highest_indexed_id = entry["vector_id"]
+            wal_offset += len(line)
+            wal_entries += 1
+        _wal_seen = (inode, wal_offset)
+    if vector_ids:
+        index.add_with_ids(np.vstack(vectors), np.array(vector_ids, dtype="int64"))
+        logger.info(f"Replayed {len(vector_ids)} vector store log entries.")
 
-        # Add query to the FAISS index
-        index.add(np.array([query_embedding]))
+def _sync_from_disk():
+    """In multi-process mode, brings the local index up to date with writes made by other processes."""
+    if not VECTOR_STORE_MULTIPROCESS:
+        return
+    try:
+        stat = os.stat(WAL_FILE)
+    except FileNotFoundError:
+        return
+    with store_lock:
+        if (stat.st_ino, stat.st_size) != _wal_seen:
+            _replay_wal(reload=True)
+
+def _reconstruct(vector_ids: List[int]) -> Dict[int, np.ndarray]:
+    """Reads vectors back out of the FAISS index; lossy for compressed index types."""
+    base = faiss.downcast_index((index.base if isinstance(index, LayeredIndex) else index).index)
+    if isinstance(base, faiss.IndexIVF):
+        base.make_direct_map()
+    indexed_ids = set(faiss.vector_to_array(index.id_map).tolist())
+    return {v: index.reconstruct(int(v)) for v in vector_ids if v in indexed_ids}
+
+def _backfill_stored_vectors():
+    """Copies vectors of records stored before vectors were kept in SQLite out of the index, once."""
+    missing = metadata_db.vector_ids_missing_vectors()
+    if missing:
+        vectors = _reconstruct(missing)
+        metadata_db.set_vectors(vectors)
+        logger.info(f"Stored {len(vectors)} vectors from the FAISS index alongside their metadata.")
+
+def _reindex_unlogged_records():
+    """
+    Re-adds records whose metadata was committed to SQLite but whose vector never reached the index
+    or the log, e.g. after a crash between the two in add_queries_to_vector_store. Such records hold
+    the newest IDs, above every indexed one. Their vectors are stored with the metadata, so they are
+    added and logged now.
+    """
+    global highest_indexed_id
+    vectors = metadata_db.vectors_after(highest_indexed_id)
+    if not vectors:
+        return
+    vector_ids = np.array(list(vectors), dtype="int64")
+    matrix = np.vstack(list(vectors.values())).astype("float32")
+    index.add_with_ids(matrix, vector_ids)
+    highest_indexed_id = int(vector_ids.max())
+    _append_to_wal([
+        {"vector_id": int(vector_id), "vector": _encode_vector(vector)} for vector_id, vector in zip(vector_ids, matrix)
+    ])
+    _compact_if_due()
+    logger.warning(f"Re-indexed {len(vector_ids)} stored records missing from the vector index and log.")
 
-        # Store metadata with the query ID
-        metadata_store[query_id] = {
-            "query": query,
-            "response": response,
-            **filter_complex_metadata(metadata)
-        }
+def _append_to_wal(entries: List[Dict[str, Any]]):
+    """Durably appends entries to the log with one fsync. A failed append leaves no partial entries behind."""
+    global wal_entries, wal_offset, _wal_seen
+    with open(WAL_FILE, "ab") as f:
+        start = f.tell()
+        try:
+            if start == 0:
+                f.write(_wal_header(wal_generation))
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        except Exception:
+            f.truncate(start)
+            raise
+        wal_offset = f.tell()
+        _wal_seen = (os.fstat(f.fileno()).st_ino, wal_offset)
+    wal_entries += len(entries)
 
-        # Save the FAISS index and metadata
+def _compact_if_due():
+    """
+    Compacts into a new snapshot once the log has grown too long. The logged writes are already
+    durable, so a failed compaction is only logged; it is tried again after the next write.
+    """
+    if wal_entries < WAL_COMPACT_EVERY:
+        return
+    try:
         save_faiss_index()
+    except Exception as e:
+        logger.error(f"Error compacting the vector store: {str(e)}")
+
+def embed_query(query: str) -> np.ndarray:
+    """Embed a query, reusing a cached vector for text that has been embedded before."""
+    return embedding_cache.get_or_compute(query, resources.embeddings.embed_query)
+
+async def aembed_query(query: str) -> np.ndarray:
+    """Async variant of embed_query that does not block the event loop on the embedding call."""
+    return await embedding_cache.aget_or_compute(query, resources.embeddings.aembed_query)
 
-        logger.info("Successfully added query and response to vector store.")
+async def aembed_queries(queries: List[str]) -> List[np.ndarray]:
+    """Embed many queries, sending every text missing from the cache in a single embed_documents call."""
+    vectors = [embedding_cache.get(query) for query in queries]
+    missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+    if missing:
+        computed = dict(zip(missing, await resources.embeddings.aembed_documents(missing)))
+        vectors = [vector if vector is not None else embedding_cache.put(query, computed[query])
+                   for query, vector in zip(queries, vectors)]
+    return vectors
+
+async def _run_in_store_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(store_executor, partial(func, *args, **kwargs))
+
+def _atomic_write(path: str, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def save_faiss_index():
+    """
+    Compacts the store: writes a full snapshot of the FAISS index with an atomic rename,
+    then starts a new log for the next generation. Metadata is already durable in SQLite.
+    """
+    global index, wal_entries, wal_generation, wal_offset, _wal_seen
+    if not _initialized:
+        return  # Nothing was loaded, so there is nothing to compact
+    with store_lock, _process_lock():
+        # Include everything other processes logged before their log is replaced
+        _sync_from_disk()
+        snapshot = index.to_index() if isinstance(index, LayeredIndex) else index
+        _atomic_write(FAISS_INDEX_FILE, lambda path: faiss.write_index(snapshot, path))
+        if VECTOR_INDEX_MMAP:
+            # Map the new snapshot; the vectors held in memory until now are part of it
+            index = _load_index()
+        wal_generation += 1
+        header = _wal_header(wal_generation)
+        _atomic_write(WAL_FILE, lambda path: _write_bytes(path, header))
+        wal_entries, wal_offset = 0, len(header)
+        _wal_seen = (os.stat(WAL_FILE).st_ino, wal_offset)
+    logger.info(f"Vector store snapshot written and log started for generation {wal_generation}.")
+
+def _write_bytes(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def add_query_to_vector_store(query: str, response: str, metadata: Dict[str, Any], query_embedding: Optional[np.ndarray] = None):
+    add_queries_to_vector_store([(query, response, metadata, query_embedding)])
+
+def add_queries_to_vector_store(items: List[tuple]):
+    """
+    Stores (query, response, metadata, query_embedding) tuples as one batch: queries without an
+    embedding are embedded in one call, the records are written in one transaction, the vectors
+    are added to FAISS as one matrix and logged with one fsync. The batch is stored completely or
+    not at all; a failed compaction afterwards does not fail it.
+    """
+    global highest_indexed_id
+    init_vector_store()
+    try:
+        vectors = [query_embedding if query_embedding is not None else embedding_cache.get(query)
+                   for query, _, _, query_embedding in items]
+        missing = list(dict.fromkeys(item[0] for item, vector in zip(items, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, resources.embeddings.embed_documents(missing)))
+            vectors = [vector if vector is not None else embedding_cache.put(item[0], computed[item[0]])
+                       for item, vector in zip(items, vectors)]
+        query_embeddings = np.vstack([np.asarray(vector, dtype="float32") for vector in vectors])
+
+        with store_lock, _process_lock():
+            # Catch up with other processes first
+            _sync_from_disk()
+
+            # Generate unique IDs for the queries and the FAISS vectors; the stored counter is shared by all processes
+            first_vector_id = metadata_db.reserve_vector_ids(len(items))
+            vector_ids = np.arange(first_vector_id, first_vector_id + len(items), dtype="int64")
+
+            # Store metadata and the vectors with their query IDs
+            query_ids = [str(uuid.uuid4()) for _ in items]
+            metadata_db.put_many([
+                (query_id, {
+                    "query": query,
+                    "response": response,
+                    "timestamp": str(datetime.utcnow()),  # Drafts carry no timestamp of their own; pruning needs one
+                    **filter_complex_metadata(metadata),
+                    "vector_id": int(vector_id)
+                }, query_embedding)
+                for query_id, (query, response, metadata, _), vector_id, query_embedding
+                in zip(query_ids, items, vector_ids, query_embeddings)
+            ])
+
+            # Add the queries to the FAISS index and log the vectors instead of rewriting the whole index
+            indexed = False
+            try:
+                index.add_with_ids(query_embeddings, vector_ids)
+                indexed = True
+                highest_indexed_id = max(highest_indexed_id, int(vector_ids[-1]))
+                _append_to_wal([
+                    {"vector_id": int(vector_id), "vector": _encode_vector(query_embedding)}
+                    for vector_id, query_embedding in zip(vector_ids, query_embeddings)
+                ])
+            except Exception:
+                # Undo the batch, so a retry stores each record once, under new vector IDs
+                metadata_db.delete_many(query_ids)
+                if indexed:
+                    _remove_vectors(vector_ids.tolist())
+                raise
+            _compact_if_due()
+
+        logger.info(f"Successfully added {len(items)} queries and responses to vector store.")
     except Exception as e:
-        logger.error(f"Error adding query to vector store: {str(e)}")
+        logger.error(f"Error adding queries to vector store: {str(e)}")
         raise
 
-def search_similar_queries(query: str, k: int = 1):
+# New records are written behind the request path, in batches
+write_queue = WriteBehindQueue(add_queries_to_vector_store, name="vector-store-writer")
+
+def flush_pending_writes() -> int:
+    """
+    Writes every queued record now so that reads by request ID see them. Always goes through the
+    queue's flush lock, so a batch the writer thread has already taken is committed before returning.
+    """
+    return write_queue.flush()
+
+def search_similar_queries_with_distances(query: str, k: int = 1, query_embedding: Optional[np.ndarray] = None):
+    """Like search_similar_queries, but returns (record, squared L2 distance) pairs, nearest first."""
+    init_vector_store()
     try:
-        query_embedding = embeddings.embed_query(query)
-        query_embedding = np.array(query_embedding).astype("float32")
+        if query_embedding is None:
+            query_embedding = embed_query(query)
+        query_embedding = np.asarray(query_embedding, dtype="float32")
 
         # Perform similarity search
-        D, I = index.search(np.array([query_embedding]), k)
-
-        # Retrieve corresponding queries and metadata
-        similar_queries = []
-        for idx in I[0]:
-            if idx < len(metadata_store):
-                query_id = list(metadata_store.keys())[idx]
-                similar_queries.append(metadata_store[query_id])
+        with store_lock:
+            _sync_from_disk()
+            D, I = index.search(np.array([query_embedding]), k)
+
+        # Retrieve corresponding queries and metadata; payload fields load on first access
+        distances = dict(zip(I[0].tolist(), D[0].tolist()))
+        similar_queries = [(record, distances[record["vector_id"]]) for record in metadata_db.get_by_vector_ids(I[0].tolist())]
         logger.info(f"Successfully found {len(similar_queries)} similar queries.")
         return similar_queries
     except Exception as e:
         logger.error(f"Error searching similar queries: {str(e)}")
         return None
 
-def delete_query_from_vector_store(request_id: str):
+def search_similar_queries_batch(query_embeddings: List[np.ndarray], k: int = 1):
+    """Searches many query vectors with one FAISS call; returns a list of (record, distance) lists per query."""
+    init_vector_store()
+    try:
+        with store_lock:
+            _sync_from_disk()
+            D, I = index.search(np.asarray(query_embeddings, dtype="float32").reshape(-1, VECTOR_DIM), k)
+
+        records = {record["vector_id"]: record for record in metadata_db.get_by_vector_ids(sorted(set(I.ravel().tolist()) - {-1}))}
+        results = [
+            [(records[vector_id], distance) for vector_id, distance in zip(ids.tolist(), dists.tolist()) if vector_id in records]
+            for ids, dists in zip(I, D)
+        ]
+        logger.info(f"Searched {len(results)} queries in one batch.")
+        return results
+    except Exception as e:
+        logger.error(f"Error searching similar queries in batch: {str(e)}")
+        return [None] * len(query_embeddings)
+
+def search_similar_queries(query: str, k: int = 1, query_embedding: Optional[np.ndarray] = None):
+    results = search_similar_queries_with_distances(query, k, query_embedding=query_embedding)
+    return None if results is None else [record for record, _ in results]
+
+async def aadd_query_to_vector_store(query: str, response: str, metadata: Dict[str, Any], query_embedding: Optional[np.ndarray] = None):
+    """
+    Queues the record for the write-behind writer and returns immediately. Queued records reach
+    search results within VECTOR_STORE_FLUSH_INTERVAL; lookups by request ID flush them first.
+    """
+    write_queue.put((query, response, metadata, query_embedding))
+
+async def asearch_similar_queries(query: str, k: int = 1, query_embedding: Optional[np.ndarray] = None):
+    """Async variant of search_similar_queries; the FAISS search runs in the store thread pool."""
+    if query_embedding is None:
+        query_embedding = await aembed_query(query)
+    return await _run_in_store_executor(search_similar_queries, query, k, query_embedding=query_embedding)
+
+async def asearch_similar_queries_with_distances(query: str, k: int = 1, query_embedding: Optional[np.ndarray] = None):
+    if query_embedding is None:
+        query_embedding = await aembed_query(query)
+    return await _run_in_store_executor(search_similar_queries_with_distances, query, k, query_embedding=query_embedding)
+
+async def asearch_similar_queries_batch(query_embeddings: List[np.ndarray], k: int = 1):
+    return await _run_in_store_executor(search_similar_queries_batch, query_embeddings, k)
+
+def get_queries_by_request_id(request_id: str):
+    """Returns the stored records for a request ID using the metadata index, without any embedding call."""
+    init_vector_store()
+    flush_pending_writes()
+    return metadata_db.get_by_request_id(request_id)
+
+def update_query_metadata(request_id: str, metadata: Dict[str, Any]) -> int:
     """
-    Deletes the query from FAISS and metadata store based on the request_id.
+    Updates the metadata of every record stored for a request ID in place. The vectors are
+    untouched, so no embedding is computed and nothing is added to the FAISS index.
+    Returns the number of records updated.
     """
+    init_vector_store()
     try:
-        if request_id in metadata_store:
-            del metadata_store[request_id]
+        flush_pending_writes()
+        updated = metadata_db.update_by_request_id(request_id, filter_complex_metadata(metadata))
+        logger.info(f"Updated metadata for {updated} records with request ID: {request_id}")
+        return updated
+    except Exception as e:
+        logger.error(f"Error updating metadata in vector store: {str(e)}")
+        raise
 
-            # Rebuild the FAISS index (FAISS doesn't support dynamic deletion)
+async def aupdate_query_metadata(request_id: str, metadata: Dict[str, Any]) -> int:
+    """Async variant of update_query_metadata; the SQLite write runs in the store thread pool."""
+    return await _run_in_store_executor(update_query_metadata, request_id, metadata)
+
+def _remove_vectors(vector_ids: List[int]):
+    """
+    Removes vectors from the index in place. Index types without removal support (HNSW) keep
+    them as tombstones, which search skips because their metadata is gone; the index is
+    rebuilt from the stored vectors once tombstones pass VECTOR_STORE_TOMBSTONE_RATIO.
+    """
+    global tombstones
+    if not vector_ids:
+        return
+    try:
+        index.remove_ids(np.array(vector_ids, dtype="int64"))
+    except RuntimeError:
+        tombstones += len(vector_ids)
+        if tombstones > TOMBSTONE_RATIO * max(1, index.ntotal):
             rebuild_faiss_index()
 
-            save_faiss_index()
-            logger.info(f"Successfully deleted query with request ID: {request_id}")
-        else:
-            logger.warning(f"Request ID {request_id} not found in metadata store.")
+def delete_query_from_vector_store(request_id: str):
+    """
+    Deletes every record stored for the request_id, the draft query and the final answer, from
+    FAISS and the metadata store.
+    """
+    init_vector_store()
+    try:
+        flush_pending_writes()
+        with store_lock, _process_lock():
+            vector_ids = metadata_db.delete_by_request_id(request_id)
+            if vector_ids:
+                _remove_vectors(vector_ids)
+                logger.info(f"Successfully deleted {len(vector_ids)} queries with request ID: {request_id}")
+            else:
+                logger.warning(f"Request ID {request_id} not found in metadata store.")
     except Exception as e:
         logger.error(f"Error deleting query from vector store: {str(e)}")
         raise
 
+def prune_queries_before(timestamp: str) -> int:
+    """Deletes all history older than `timestamp` (same format as the stored timestamps). Returns the number removed."""
+    init_vector_store()
+    try:
+        flush_pending_writes()
+        with store_lock, _process_lock():
+            vector_ids = metadata_db.delete_before(timestamp)
+            _remove_vectors(vector_ids)
+        logger.info(f"Pruned {len(vector_ids)} queries older than {timestamp}.")
+        return len(vector_ids)
+    except Exception as e:
+        logger.error(f"Error pruning vector store: {str(e)}")
+        raise
+
+def stored_vectors():
+    """Returns (vector_ids, vectors) for every stored record, read from the metadata store."""
+    init_vector_store()
+    rows = list(metadata_db.iter_vectors())
+    if not rows:
+        return np.empty(0, dtype="int64"), np.empty((0, VECTOR_DIM), dtype="float32")
+    vector_ids, vectors = zip(*rows)
+    return np.array(vector_ids, dtype="int64"), np.vstack(vectors)
+
+def replace_index(new_index):
+    """Swaps in a fully built index and writes it as the new snapshot."""
+    global index, highest_indexed_id, tombstones
+    init_vector_store()
+    with store_lock, _process_lock():
+        index = configure_search(new_index)
+        highest_indexed_id = _highest_indexed_id()
+        tombstones = max(0, index.ntotal - metadata_db.count())
+        save_faiss_index()
+
 def rebuild_faiss_index():
-    """Rebuilds the FAISS index after deletion."""
-    global index
-    index = faiss.IndexFlatL2(VECTOR_DIM)
-    for query_id, data in metadata_store.items():
-        query_embedding = embeddings.embed_query(data['query'])
-        query_embedding = np.array(query_embedding).astype("float32")
-        index.add(np.array([query_embedding]))
+    """
+    Rebuilds the FAISS index from the stored vectors, dropping tombstones. Keeps the type of the loaded
+    index, which build_index may have chosen over VECTOR_INDEX_TYPE. Never calls the embedding service.
+    """
+    init_vector_store()
+    with store_lock, _process_lock():
+        vector_ids, vectors = stored_vectors()
+        new_index = _new_index(_loaded_index_type(), training_vectors=vectors)
+        if len(vectors):
+            new_index.add_with_ids(vectors, vector_ids)
+        replace_index(new_index)
+    logger.info(f"Rebuilt the FAISS index from {len(vectors)} stored vectors.")
 
 def delete_all_queries():
     """
     Deletes all queries and resets the FAISS index and metadata.
     """
+    init_vector_store()
     try:
-        global index, metadata_store
-        index.reset()
-        metadata_store = {}
-        save_faiss_index()
+        global tombstones
+        flush_pending_writes()
+        with store_lock, _process_lock():
+            index.reset()
+            metadata_db.clear()
+            tombstones = 0
+            save_faiss_index()
         logger.info("Successfully deleted all queries from vector store.")
     except Exception as e:
         logger.error(f"Error deleting all queries from vector store: {str(e)}")
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, List
+from app.utils.logger import logger
+
+VECTOR_STORE_FLUSH_SIZE = int(os.getenv("VECTOR_STORE_FLUSH_SIZE", "32"))  # Pending records that trigger a flush
+VECTOR_STORE_FLUSH_INTERVAL = float(os.getenv("VECTOR_STORE_FLUSH_INTERVAL", "0.5"))  # Max seconds a record waits
+VECTOR_STORE_MAX_ATTEMPTS = int(os.getenv("VECTOR_STORE_MAX_ATTEMPTS", "5"))  # Failed writes before a record is given up
+MAX_RETRY_DELAY = 30.0  # Longest pause of the writer thread after failed flushes
+DEAD_LETTERS_KEPT = 1000
+
+
+class WriteBehindQueue:
+    """
+    Collects items from many requests and hands them to `flush_func` as one batch, from a background
+    thread, once `max_batch` items are pending or `interval` seconds have passed.
+
+    When a batch fails its items are written one by one, so one bad item does not hold back the
+    others. Items that still fail go back to the front of the queue, and the writer thread backs
+    off exponentially. After `max_attempts` failures an item is logged and moved to `dead_letters`.
+    """
+
+    def __init__(self, flush_func: Callable[[List[Any]], None], max_batch: int = VECTOR_STORE_FLUSH_SIZE,
+                 interval: float = VECTOR_STORE_FLUSH_INTERVAL, name: str = "write-behind",
+                 max_attempts: int = VECTOR_STORE_MAX_ATTEMPTS):
+        self.flush_func = flush_func
+        self.max_batch = max_batch
+        self.interval = interval
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.dead_letters = deque(maxlen=DEAD_LETTERS_KEPT)
+        self._items = []  # [item, failed attempts] pairs
+        self._consecutive_failures = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # Keeps batches in enqueue order
+        self._stopping = False
+        self._thread = None
+        self._stats = {"enqueued": 0, "flushed": 0, "flushes": 0, "failures": 0, "dead_lettered": 0}
+
+    def put(self, item):
+        with self._cond:
+            self._items.append([item, 0])
+            self._stats["enqueued"] += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            if len(self._items) >= self.max_batch:
+                self._cond.notify()
+
+    def flush(self) -> int:
+        """Writes every pending item now, in the calling thread. Returns the number written."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._items = self._items, []
+            if not batch:
+                return 0
+            start = time.perf_counter()
+            try:
+                self.flush_func([item for item, _ in batch])
+            except Exception as e:
+                logger.error(f"Error flushing {len(batch)} queued writes: {str(e)}")
+                written = self._flush_individually(batch) if len(batch) > 1 else self._failed(batch, e)
+                with self._cond:
+                    self._stats["flushes"] += 1
+                return written
+            with self._cond:
+                self._stats["flushed"] += len(batch)
+                self._stats["flushes"] += 1
+                self._consecutive_failures = 0
+            logger.info(f"Flushed {len(batch)} queued writes in {(time.perf_counter() - start) * 1000:.1f} ms.")
+            return len(batch)
+
+    def _flush_individually(self, batch: list) -> int:
+        written, failed, error = 0, [], None
+        for entry in batch:
+            try:
+                self.flush_func([entry[0]])
+                written += 1
+            except Exception as e:
+                failed.append(entry)
+                error = e
+        with self._cond:
+            self._stats["flushed"] += written
+        if failed:
+            self._failed(failed, error)
+        return written
+
+    def _failed(self, entries: list, error: Exception) -> int:
+        """Re-queues failed entries at the front, dead-lettering those out of attempts. Returns 0 written."""
+        retry = []
+        for entry in entries:
+            entry[1] += 1
+            if entry[1] >= self.max_attempts:
+                logger.error(f"Giving up on a queued write after {entry[1]} attempts: {str(error)}")
+                self.dead_letters.append({"item": entry[0], "error": str(error), "time": time.time()})
+            else:
+                retry.append(entry)
+        with self._cond:
+            self._items = retry + self._items
+            self._stats["failures"] += 1
+            self._stats["dead_lettered"] += len(entries) - len(retry)
+            self._consecutive_failures += 1
+        if retry:
+            logger.warning(f"Will retry {len(retry)} queued writes.")
+        return 0
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "pending": len(self._items), "max_batch": self.max_batch, "interval_seconds": self.interval,
+                    "dead_letters": len(self.dead_letters)}
+
+    def stop(self):
+        """Stops the background thread and durably writes whatever is still pending."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+        self.flush()
+
+    def _retry_delay(self) -> float:
+        if not self._consecutive_failures:
+            return self.interval
+        return min(MAX_RETRY_DELAY, self.interval * 2 ** self._consecutive_failures)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # A full queue only cuts the wait short while writes are succeeding
+                self._cond.wait_for(
+                    lambda: self._stopping or (len(self._items) >= self.max_batch and not self._consecutive_failures),
+                    timeout=self._retry_delay(),
+                )
+                if self._stopping:
+                    return
+            self.flush()
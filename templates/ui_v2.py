@@ -109,20 +109,47 @@ if prompt := st.chat_input("What's on your mind?"):
         else:  # This `else` block will be executed later when we have the bot's response
             st.markdown(f'<div class="bot-message">{message["content"]}</div>', unsafe_allow_html=True)
 
-    # Send request to FastAPI
+    # Send request to FastAPI and render each pipeline stage as it streams in
     try:
-        response = requests.post("http://localhost:8080/ask", json={"query": prompt})
+        response = requests.post("http://localhost:8080/ask/stream", json={"query": prompt}, stream=True)
 
         # Handle successful response
         if response.status_code == 200:
-            data = response.json()
-            answer = data["formatted_data"]
+            status_placeholder = st.empty()
+            answer_placeholder = st.empty()
+            answer = ""
+            rows = []
+            event = None
+
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                    continue
+                if not line.startswith("data: "):
+                    continue
+                payload = json.loads(line[len("data: "):])
+
+                if event == "query":
+                    status_placeholder.caption("Cube.js query generated, loading data...")
+                elif event == "progress":
+                    status_placeholder.caption(f"Cube.js is still computing the result ({payload['waited_seconds']}s)...")
+                elif event == "rows":
+                    rows.extend(payload["rows"])
+                    status_placeholder.caption(f"Loaded {len(rows)} rows, writing answer...")
+                elif event == "token":
+                    answer += payload["text"]
+                    answer_placeholder.markdown(f'<div class="bot-message">{answer}</div>', unsafe_allow_html=True)
+                elif event == "done":
+                    answer = payload["formatted_data"]
+                    status_placeholder.empty()
+                    answer_placeholder.markdown(f'<div class="bot-message">{answer}</div>', unsafe_allow_html=True)
+                elif event == "error":
+                    status_placeholder.empty()
+                    st.error(f"Error from FastAPI: {payload['status_code']} - {payload['detail']}")
 
             # Add bot response to the current chat session
-            st.session_state.chat_sessions[-1].append({"role": "assistant", "content": answer})
-
-            # Display the bot's response
-            st.markdown(f'<div class="bot-message">{answer}</div>', unsafe_allow_html=True)
+            if answer:
+                st.session_state.chat_sessions[-1].append({"role": "assistant", "content": answer})
 
             # ... (plotting logic remains the same)
 
@@ -0,0 +1,170 @@
+import json
+import os
+import zlib
+import faiss
+import numpy as np
+import pytest
+from app.vector_store import store_manager
+from app.vector_store.index_factory import create_index
+
+
+def embedding(text: str) -> np.ndarray:
+    """A deterministic stand-in for the OpenAI embedding of `text`."""
+    return np.random.default_rng(zlib.crc32(text.encode())).random(store_manager.VECTOR_DIM).astype("float32")
+
+
+def restart():
+    """Closes the store as a process exit would; the next call opens it from the files again."""
+    if store_manager.metadata_db is not None:
+        store_manager.metadata_db.close()
+    store_manager.metadata_db = None
+    store_manager.index = None
+    store_manager.highest_indexed_id = -1
+    store_manager.tombstones = 0
+    store_manager.wal_entries = 0
+    store_manager.wal_generation = 0
+    store_manager.wal_offset = 0
+    store_manager._wal_seen = None
+    store_manager._initialized = False
+
+
+def add(*queries: str, request_id: str = None, **metadata):
+    store_manager.add_queries_to_vector_store([
+        (query, "response", {"request_id": request_id or query, **metadata}, embedding(query)) for query in queries
+    ])
+
+
+def nearest(query: str, k: int = 1):
+    return [record["query"] for record in store_manager.search_similar_queries(query, k, query_embedding=embedding(query))]
+
+
+def indexed_ids() -> list:
+    return faiss.vector_to_array(store_manager.index.id_map).tolist()
+
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    """Runs each test against store files in its own temporary directory."""
+    monkeypatch.chdir(tmp_path)
+    restart()
+    yield tmp_path
+    restart()
+
+
+@pytest.fixture(params=["flat", "hnsw"])
+def store(request):
+    """An empty store of each index type."""
+    store_manager.init_vector_store()
+    store_manager.replace_index(create_index(store_manager.VECTOR_DIM, request.param))
+    return request.param
+
+
+def test_add_search_and_restart(store):
+    add("total revenue by month", "average order value", "count of customers")
+    assert nearest("average order value") == ["average order value"]
+
+    restart()
+    assert nearest("average order value") == ["average order value"]
+    assert store_manager._loaded_index_type() == store
+    assert sorted(indexed_ids()) == [0, 1, 2]
+
+
+def test_restart_replays_log_after_compaction(store, monkeypatch):
+    monkeypatch.setattr(store_manager, "WAL_COMPACT_EVERY", 4)
+    add(*(f"question {i}" for i in range(10)))
+    for i in range(10, 13):
+        add(f"question {i}")
+    assert store_manager.wal_generation >= 1
+
+    restart()
+    assert nearest("question 12") == ["question 12"]
+    assert sorted(indexed_ids()) == list(range(13))
+
+
+def test_snapshot_written_before_a_crash_is_not_replayed_twice(store):
+    add("first question", "second question")
+    # Crash after the snapshot is written but before the log is replaced
+    faiss.write_index(store_manager.index, store_manager.FAISS_INDEX_FILE)
+
+    restart()
+    store_manager.init_vector_store()
+    assert sorted(indexed_ids()) == [0, 1]
+
+
+def test_delete_by_request_id_removes_draft_and_answer(store):
+    add("draft query", request_id="R1")
+    add("final answer", request_id="R1", status="pass")
+    add("other question", request_id="R2")
+
+    store_manager.delete_query_from_vector_store("R1")
+    assert store_manager.get_queries_by_request_id("R1") == []
+    assert nearest("final answer") in ([], ["other question"])
+    assert store_manager.metadata_db.count() == 1
+
+
+def test_deleted_vector_ids_are_never_reused(store):
+    add(*(f"kept question {i}" for i in range(10)))
+    add("old deleted question")
+    store_manager.delete_query_from_vector_store("old deleted question")
+    store_manager.save_faiss_index()
+
+    restart()
+    add("brand new question")
+    ids = indexed_ids()
+    assert len(ids) == len(set(ids))
+    assert nearest("old deleted question") != ["brand new question"]
+    assert store_manager.metadata_db.get_by_request_id("brand new question")[0]["vector_id"] == 11
+
+
+def test_tombstone_rebuild_keeps_index_type(store):
+    add(*(f"question {i}" for i in range(10)))
+    for i in range(5):
+        store_manager.delete_query_from_vector_store(f"question {i}")
+
+    assert store_manager.tombstones == 0
+    assert store_manager.index.ntotal == 5
+    assert store_manager._loaded_index_type() == store
+
+
+def test_failed_log_append_stores_nothing(store, monkeypatch):
+    add("first question")
+    with monkeypatch.context() as patch, pytest.raises(OSError):
+        patch.setattr(store_manager.os, "fsync", lambda fd: (_ for _ in ()).throw(OSError("disk full")))
+        add("failed question")
+
+    add("retried question")
+    assert store_manager.get_queries_by_request_id("failed question") == []
+    restart()
+    assert nearest("retried question") == ["retried question"]
+    assert store_manager.metadata_db.count() == 2
+
+
+def test_prune_removes_old_records_and_keeps_new_drafts(store):
+    add("old answer", timestamp="2024-01-01 00:00:00")
+    add("new draft")  # Drafts carry no timestamp of their own
+
+    restart()
+    assert store_manager.prune_queries_before("2025-01-01") == 1
+    assert nearest("new draft") == ["new draft"]
+    assert store_manager.get_queries_by_request_id("old answer") == []
+
+
+def test_migrates_legacy_json_and_positional_index():
+    queries = ["legacy one", "legacy two", "legacy three"]
+    legacy_index = faiss.IndexFlatL2(store_manager.VECTOR_DIM)
+    legacy_index.add(np.vstack([embedding(query) for query in queries]))
+    faiss.write_index(legacy_index, store_manager.FAISS_INDEX_FILE)
+    with open(store_manager.METADATA_FILE, "w") as f:
+        json.dump({f"id-{i}": {"query": query, "response": "r", "request_id": query} for i, query in enumerate(queries)}, f)
+    os.utime(store_manager.METADATA_FILE, (1726000000, 1726000000))
+
+    store_manager.init_vector_store()
+    assert nearest("legacy two") == ["legacy two"]
+    assert not os.path.exists(store_manager.METADATA_FILE)
+    assert store_manager.metadata_db.get("id-1")["timestamp"].startswith("2024-09-10")
+
+    add("new question")
+    restart()
+    assert nearest("new question") == ["new question"]
+    assert store_manager.prune_queries_before("2025-01-01") == 3
+    assert store_manager.metadata_db.count() == 1